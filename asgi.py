@@ -0,0 +1,7 @@
+"""Entrada do hypercorn: hypercorn -c file:hypercorn.conf.py asgi:app
+
+HTTP/2 e conexões persistentes ficam com o hypercorn. A aplicação WSGI roda no pool
+de threads do hypercorn, então requisições concorrentes sobrepõem as esperas no banco
+(o WsgiToAsgi do asgiref executaria todas numa única thread por worker).
+"""
+from src.main import app
@@ -0,0 +1,18 @@
+# Uso: gunicorn -c gunicorn.conf.py src.main:app
+# Workers gthread sobrepõem as esperas de I/O no banco entre requisições;
+# o pool do SQLAlchemy (src/main.py) é dimensionado para no mínimo `threads` conexões.
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:5000')
+workers = max(2, os.cpu_count() or 1)
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', '8'))
+keepalive = 65
+
+def on_starting(server):
+    # Cache em memória é por processo: invalidações de um worker não chegam aos outros
+    if workers > 1 and not os.getenv('REDIS_URL'):
+        server.log.warning(
+            'REDIS_URL não definido com %d workers: cada worker terá seu próprio cache '
+            'e poderá servir respostas já invalidadas por outro', workers
+        )
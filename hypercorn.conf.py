@@ -0,0 +1,15 @@
+# Configuração do hypercorn; uso e funcionamento descritos em asgi.py
+import logging
+import os
+
+bind = [os.getenv('HYPERCORN_BIND', '0.0.0.0:5000')]
+workers = max(2, os.cpu_count() or 1)
+worker_class = 'asyncio'
+keep_alive_timeout = 65
+
+# Cache em memória é por processo: invalidações de um worker não chegam aos outros
+if workers > 1 and not os.getenv('REDIS_URL'):
+    logging.getLogger('hypercorn.error').warning(
+        'REDIS_URL não definido com %d workers: cada worker terá seu próprio cache '
+        'e poderá servir respostas já invalidadas por outro', workers
+    )
@@ -0,0 +1,65 @@
+import hashlib
+import time
+from functools import wraps
+from flask import current_app, make_response, request
+from flask_caching import Cache
+
+cache = Cache()
+
+def _versao(namespace):
+    """Versão atual do namespace.
+
+    Se a chave de versão sumir (expulsa do cache), uma versão nova e única é gravada
+    em vez de voltar a 0: chaves de versões anteriores nunca voltam a valer.
+    """
+    chave = f'{namespace}:versao'
+    versao = cache.get(chave)
+    if versao is None:
+        nova = time.time_ns()
+        cache.add(chave, nova, timeout=0)
+        versao = cache.get(chave) or nova
+    return versao
+
+def cache_resposta(namespace, timeout=60):
+    """Cache da resposta GET por query string, com ETag e suporte a If-None-Match.
+
+    A chave inclui a versão do namespace, trocada por invalidar() a cada escrita;
+    respostas antigas simplesmente deixam de ser encontradas e expiram. O cliente
+    sempre revalida (no-cache) e recebe 304 sem consulta ao banco enquanto nada mudar.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            chave = f'{namespace}:{_versao(namespace)}:{request.full_path}'
+            em_cache = cache.get(chave)
+
+            if em_cache is None:
+                resposta = make_response(view(*args, **kwargs))
+                # Respostas em streaming não são bufferizadas nem guardadas
+                if resposta.status_code != 200 or resposta.is_streamed:
+                    return resposta
+                corpo = resposta.get_data()
+                em_cache = (corpo, hashlib.blake2b(corpo, digest_size=16).hexdigest())
+                cache.set(chave, em_cache, timeout=timeout)
+
+            corpo, etag = em_cache
+            resposta = current_app.response_class(corpo, mimetype='application/json')
+            resposta.set_etag(etag)
+            resposta.headers['Cache-Control'] = 'no-cache'
+            return resposta.make_conditional(request)
+        return wrapper
+    return decorator
+
+def em_cache(namespace, chave, calcular, timeout=60):
+    """Valor de calcular() em cache, descartado junto com as respostas do namespace"""
+    chave = f'{namespace}:{_versao(namespace)}:{chave}'
+    valor = cache.get(chave)
+    if valor is None:
+        valor = calcular()
+        cache.set(chave, valor, timeout=timeout)
+    return valor
+
+def invalidar(*namespaces):
+    """Invalida todas as respostas em cache dos namespaces"""
+    for namespace in namespaces:
+        cache.set(f'{namespace}:versao', time.time_ns(), timeout=0)
@@ -0,0 +1,14 @@
+"""Cria as tabelas do banco de dados.
+
+Uso: python -m src.init_db
+Bancos criados por versões anteriores: python -m src.upgrade_db
+"""
+from src.main import app
+from src.models.user import db
+
+def init_db():
+    with app.app_context():
+        db.create_all()
+
+if __name__ == '__main__':
+    init_db()
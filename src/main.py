@@ -3,8 +3,14 @@ import sys
 # DON'T CHANGE THIS !!!
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
-from flask import Flask, send_from_directory
+import hashlib
+import orjson
+from flask import Flask, Response, request, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+from sqlalchemy import event
+from src.cache import cache
+from src.serializacao import json_default
 from src.models.user import db
 from src.routes.user import user_bp
 from src.routes.cliente import cliente_bp
@@ -13,42 +19,120 @@ from src.routes.campanha import campanha_bp
 from src.routes.resgate import resgate_bp
 from src.routes.dashboard import dashboard_bp
 
+class OrjsonProvider(JSONProvider):
+    """Serialização JSON via orjson (datetime e Enum nativos, escrita direto em bytes)"""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=json_default).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=json_default), mimetype='application/json'
+        )
+
 app = Flask(__name__, static_folder=os.path.join(os.path.dirname(__file__), 'static'))
 app.config['SECRET_KEY'] = 'asdf#FGSgvasgf$5$WGT'
+app.json = OrjsonProvider(app)
 
 # Configurar CORS para permitir comunicação com o frontend
 CORS(app)
 
-app.register_blueprint(user_bp, url_prefix='/api')
-app.register_blueprint(cliente_bp, url_prefix='/api')
-app.register_blueprint(visita_bp, url_prefix='/api')
-app.register_blueprint(campanha_bp, url_prefix='/api')
-app.register_blueprint(resgate_bp, url_prefix='/api')
-app.register_blueprint(dashboard_bp, url_prefix='/api')
+for blueprint in (user_bp, cliente_bp, visita_bp, campanha_bp, resgate_bp, dashboard_bp):
+    app.register_blueprint(blueprint, url_prefix='/api')
 
 # uncomment if you need to use database
-app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+database_url = os.getenv(
+    'DATABASE_URL',
+    f"sqlite:///{os.path.join(os.path.dirname(__file__), 'database', 'app.db')}"
+)
+# PostgreSQL sempre via psycopg 3 (prepared statements no servidor, salvo atrás do PgBouncer)
+if database_url.startswith(('postgres://', 'postgresql://')):
+    database_url = 'postgresql+psycopg://' + database_url.split('://', 1)[1]
+app.config['SQLALCHEMY_DATABASE_URI'] = database_url
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+
+# Pool persistente por worker. Tamanhos por worker: multiplicados pelo número de workers,
+# devem caber no max_connections (ou no pool do PgBouncer)
+# Com DB_PGBOUNCER=1 (PgBouncer em modo transaction) cada transação pode cair num backend
+# diferente: sem prepared statements no servidor e sem SET por conexão; o statement_timeout
+# fica no banco (ALTER ROLE <usuario> SET statement_timeout = '5s')
+ATRAS_DO_PGBOUNCER = os.getenv('DB_PGBOUNCER') == '1'
+STATEMENT_TIMEOUT_MS = int(os.getenv('DB_STATEMENT_TIMEOUT_MS', '5000'))
+if database_url.startswith('postgresql'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+        'pool_size': int(os.getenv('DB_POOL_SIZE', max(10, int(os.getenv('GUNICORN_THREADS', '8'))))),
+        'max_overflow': int(os.getenv('DB_MAX_OVERFLOW', '20')),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'connect_args': {
+            'prepare_threshold': None if ATRAS_DO_PGBOUNCER else 5
+        }
+    }
 db.init_app(app)
-with app.app_context():
-    db.create_all()
 
-@app.route('/', defaults={'path': ''})
-@app.route('/<path:path>')
+if database_url.startswith('postgresql') and not ATRAS_DO_PGBOUNCER:
+    with app.app_context():
+        @event.listens_for(db.engine, 'connect')
+        def definir_statement_timeout(conexao, _):
+            """statement_timeout da sessão, definido ao abrir cada conexão do pool"""
+            with conexao.cursor() as cursor:
+                cursor.execute(f'SET statement_timeout = {STATEMENT_TIMEOUT_MS}')
+            conexao.commit()
+
+# Cache de respostas: Redis quando REDIS_URL estiver definido, senão memória do processo.
+# Sem Redis cada worker tem o seu cache e as invalidações não chegam aos demais
+# (os arquivos de configuração do gunicorn/hypercorn avisam na inicialização)
+app.config['CACHE_TYPE'] = 'RedisCache' if os.getenv('REDIS_URL') else 'SimpleCache'
+app.config['CACHE_REDIS_URL'] = os.getenv('REDIS_URL')
+app.config['CACHE_DEFAULT_TIMEOUT'] = 60
+cache.init_app(app)
+
+# DDL roda uma única vez (python -m src.init_db), não em cada worker do gunicorn
+if os.getenv('FLASK_INIT_DB') == '1':
+    with app.app_context():
+        db.create_all()
+
+# Em produção os estáticos ficam com o Nginx (deploy/nginx.conf): SERVE_STATIC=0
+SERVE_STATIC = os.getenv('SERVE_STATIC', '1') == '1'
+
+# index.html do SPA carregado uma única vez; servido da memória com ETag
+INDEX_BYTES = None
+INDEX_ETAG = None
+if SERVE_STATIC and app.static_folder is not None:
+    index_file = os.path.join(app.static_folder, 'index.html')
+    if os.path.exists(index_file):
+        with open(index_file, 'rb') as f:
+            INDEX_BYTES = f.read()
+        INDEX_ETAG = hashlib.blake2b(INDEX_BYTES, digest_size=8).hexdigest()
+
+# Arquivos em assets/ têm hash no nome e podem ficar em cache indefinidamente
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
+
 def serve(path):
     static_folder_path = app.static_folder
     if static_folder_path is None:
             return "Static folder not configured", 404
 
     if path != "" and os.path.exists(os.path.join(static_folder_path, path)):
-        return send_from_directory(static_folder_path, path)
+        max_age = ASSETS_MAX_AGE if path.startswith('assets/') else None
+        return send_from_directory(static_folder_path, path, max_age=max_age)
     else:
-        index_path = os.path.join(static_folder_path, 'index.html')
-        if os.path.exists(index_path):
-            return send_from_directory(static_folder_path, 'index.html')
+        if INDEX_BYTES is not None:
+            response = Response(INDEX_BYTES, mimetype='text/html')
+            response.set_etag(INDEX_ETAG)
+            response.headers['Cache-Control'] = 'no-cache'
+            return response.make_conditional(request)
         else:
             return "index.html not found", 404
 
+if SERVE_STATIC:
+    app.add_url_rule('/', 'serve', serve, defaults={'path': ''})
+    app.add_url_rule('/<path:path>', 'serve', serve)
+
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000, debug=True)
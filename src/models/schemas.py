@@ -0,0 +1,111 @@
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Annotated, Optional
+from pydantic_core import PydanticCustomError
+from pydantic import AfterValidator, BaseModel, BeforeValidator, Field, RootModel, ValidationError
+from src.models.user import LojaEnum, NivelEnum
+
+CENTAVOS = Decimal('0.01')
+# Maior valor que cabe em NUMERIC(12, 2)
+VALOR_MAXIMO = Decimal('9999999999.99')
+
+# Campos texto obrigatórios: string vazia conta como ausente
+Obrigatorio = Annotated[str, Field(min_length=1)]
+
+def _centavos(valor: Decimal) -> Decimal:
+    """Arredonda aos centavos da coluna NUMERIC(12, 2) e exige valor positivo que caiba nela"""
+    if valor > VALOR_MAXIMO:
+        raise PydanticCustomError('valor_maximo', 'excede o máximo permitido')
+    valor = valor.quantize(CENTAVOS, rounding=ROUND_HALF_UP)
+    if valor <= 0:
+        raise ValueError('deve ser maior que zero')
+    return valor
+
+# Valores monetários: Decimal positivo, em centavos
+Valor = Annotated[Decimal, AfterValidator(_centavos)]
+
+# Loja opcional: '' e null significam "sem loja" (campanha global / visita sem loja)
+LojaOpcional = Annotated[Optional[LojaEnum], BeforeValidator(lambda v: v or None)]
+
+# Mensagem única de campos obrigatórios mantida por compatibilidade, por modelo:
+# (mensagem, campos); ausente, null ou string vazia conta como não informado
+_MENSAGENS_OBRIGATORIOS = {
+    'ClienteCreate': ('CPF, nome e telefone são obrigatórios', {'cpf', 'nome', 'telefone'}),
+    'VisitaCreate': ('cliente_id e valor_compra são obrigatórios', {'cliente_id', 'valor_compra'}),
+    'VisitaLote': ('cliente_id e valor_compra são obrigatórios', {'cliente_id', 'valor_compra'})
+}
+
+# Mensagens por tipo de erro, antes das mensagens por campo
+_MENSAGENS_TIPO = {
+    'valor_maximo': 'Valor da compra excede o máximo permitido'
+}
+
+_MENSAGENS_INVALIDO = {
+    'loja': 'Loja inválida',
+    'nivel': 'Nível inválido',
+    'valor_compra': 'Valor da compra deve ser maior que zero'
+}
+
+def mensagem_erro(erro: ValidationError) -> str:
+    """Converte o primeiro erro de validação na mensagem usada pela API"""
+    detalhe = erro.errors()[0]
+    loc = detalhe['loc']
+    # Em lotes o primeiro elemento é a posição do item na lista
+    prefixo = ''
+    if loc and isinstance(loc[0], int):
+        prefixo, loc = f'Item {loc[0]}: ', loc[1:]
+    if not loc:
+        return prefixo + 'Dados inválidos'
+    campo = str(loc[0])
+    mensagem, obrigatorios = _MENSAGENS_OBRIGATORIOS.get(erro.title, (None, ()))
+    if campo in obrigatorios and (detalhe['type'] in ('missing', 'string_too_short') or detalhe['input'] is None):
+        return prefixo + mensagem
+    if detalhe['type'] in ('missing', 'string_too_short'):
+        return f'{prefixo}{campo} é obrigatório'
+    if detalhe['type'] in _MENSAGENS_TIPO:
+        return prefixo + _MENSAGENS_TIPO[detalhe['type']]
+    return prefixo + _MENSAGENS_INVALIDO.get(campo, f'{campo} inválido')
+
+class ClienteCreate(BaseModel):
+    cpf: Obrigatorio
+    nome: Obrigatorio
+    telefone: Obrigatorio
+    email: Optional[str] = None
+    sem_email: bool = False
+
+class VisitaCreate(BaseModel):
+    cliente_id: int
+    valor_compra: Valor
+    loja: LojaOpcional = None
+
+# Lote de visitas (POST /visitas/batch): sincronização de fim de dia do PDV
+class VisitaLote(RootModel[Annotated[list[VisitaCreate], Field(min_length=1, max_length=1000)]]):
+    pass
+
+class VisitaUpdate(BaseModel):
+    valor_compra: Optional[Valor] = None
+    loja: LojaOpcional = None
+
+class CampanhaCreate(BaseModel):
+    nome: Obrigatorio
+    data_inicio: datetime
+    data_fim: datetime
+    loja: LojaOpcional = None
+    ativa: bool = True
+    threshold_visitas: int = 5
+    fator_pontuacao: float = 1.0
+
+class CampanhaUpdate(BaseModel):
+    nome: Optional[str] = None
+    data_inicio: Optional[datetime] = None
+    data_fim: Optional[datetime] = None
+    loja: LojaOpcional = None
+    ativa: Optional[bool] = None
+    threshold_visitas: Optional[int] = None
+    fator_pontuacao: Optional[float] = None
+
+class BrindeCreate(BaseModel):
+    produto_id: int
+    campanha_id: int
+    nivel: NivelEnum
+    quantidade_disponivel: int = 0
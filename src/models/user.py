@@ -1,9 +1,25 @@
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import DDL, event
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from datetime import datetime
 from enum import Enum
 
 db = SQLAlchemy()
 
+def dialect_insert(model):
+    """INSERT do dialeto em uso (PostgreSQL ou SQLite), com suporte a ON CONFLICT"""
+    if db.engine.dialect.name == 'postgresql':
+        return pg_insert(model)
+    return sqlite_insert(model)
+
+# Busca por substring (ILIKE '%x%') usa índices GIN de trigramas no PostgreSQL
+event.listen(
+    db.metadata,
+    'before_create',
+    DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm').execute_if(dialect='postgresql')
+)
+
 class LojaEnum(Enum):
     JABAQUARA = "Mega Loja Jabaquara"
     INDIANOPOLIS = "Indianópolis"
@@ -17,13 +33,33 @@ class NivelEnum(Enum):
     PRATA = "Prata"
     OURO = "Ouro"
 
+# Posição na hierarquia (Bronze < Prata < Ouro): comparação de nível vira comparação de inteiros
+for _rank, _nivel in enumerate(NivelEnum, start=1):
+    _nivel.rank = _rank
+
 class StatusResgateEnum(Enum):
     PENDENTE = "Pendente"
     ENTREGUE = "Entregue"
     CANCELADO = "Cancelado"
 
+def enum_coluna(enum_cls):
+    """Enum armazenado como VARCHAR + CHECK (sem tipo ENUM nativo: novos valores não exigem ALTER TYPE)"""
+    return db.Enum(
+        enum_cls,
+        native_enum=False,
+        length=32,
+        validate_strings=True,
+        create_constraint=True
+    )
+
 class Cliente(db.Model):
     __tablename__ = 'clientes'
+    __table_args__ = (
+        db.Index(
+            'clientes_nome_trgm', 'nome',
+            postgresql_using='gin', postgresql_ops={'nome': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cpf = db.Column(db.String(11), unique=True, nullable=False)
@@ -33,10 +69,15 @@ class Cliente(db.Model):
     sem_email = db.Column(db.Boolean, default=False)
     data_cadastro = db.Column(db.DateTime, default=datetime.utcnow)
     
+    # Contadores desnormalizados, mantidos por triggers em visitas/pontos
+    total_visitas = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    total_gasto = db.Column(db.Numeric(12, 2), nullable=False, default=0, server_default='0')
+    pontos_totais = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    
     # Relacionamentos
-    visitas = db.relationship('Visita', backref='cliente', lazy=True)
-    pontos = db.relationship('Ponto', backref='cliente', lazy=True)
-    resgates = db.relationship('Resgate', backref='cliente', lazy=True)
+    visitas = db.relationship('Visita', back_populates='cliente', lazy=True)
+    pontos = db.relationship('Ponto', back_populates='cliente', lazy=True)
+    resgates = db.relationship('Resgate', back_populates='cliente', lazy=True)
 
     def __repr__(self):
         return f'<Cliente {self.nome}>'
@@ -49,19 +90,31 @@ class Cliente(db.Model):
             'telefone': self.telefone,
             'email': self.email,
             'sem_email': self.sem_email,
-            'data_cadastro': self.data_cadastro.isoformat() if self.data_cadastro else None,
-            'total_visitas': len(self.visitas),
-            'pontos_totais': sum([p.pontos_acumulados for p in self.pontos])
+            'data_cadastro': self.data_cadastro,
+            'total_visitas': self.total_visitas,
+            'total_gasto': self.total_gasto,
+            'pontos_totais': self.pontos_totais
         }
 
 class Visita(db.Model):
     __tablename__ = 'visitas'
+    __table_args__ = (
+        # Filtros por período (e loja) somando valor_compra são atendidos só pelo índice
+        db.Index('visitas_data_loja_valor', 'data_visita', 'loja', 'valor_compra'),
+        # Também serve às buscas só por cliente_id (prefixo)
+        db.Index('visitas_cliente_data', 'cliente_id', 'data_visita'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
     data_visita = db.Column(db.DateTime, default=datetime.utcnow)
-    valor_compra = db.Column(db.Float, nullable=False)
-    loja = db.Column(db.Enum(LojaEnum), nullable=True)
+    valor_compra = db.Column(db.Numeric(12, 2), nullable=False)
+    loja = db.Column(enum_coluna(LojaEnum), nullable=True)
+    # Pontos concedidos no registro: estorno exato mesmo se a campanha mudar (NULL em visitas antigas)
+    pontos_gerados = db.Column(db.Integer, nullable=True)
+    
+    # Relacionamentos
+    cliente = db.relationship('Cliente', back_populates='visitas')
 
     def __repr__(self):
         return f'<Visita {self.cliente_id} - R${self.valor_compra}>'
@@ -70,19 +123,24 @@ class Visita(db.Model):
         return {
             'id': self.id,
             'cliente_id': self.cliente_id,
-            'data_visita': self.data_visita.isoformat() if self.data_visita else None,
+            'data_visita': self.data_visita,
             'valor_compra': self.valor_compra,
-            'loja': self.loja.value if self.loja else None
+            'loja': self.loja,
+            'pontos_gerados': self.pontos_gerados
         }
 
 class Ponto(db.Model):
     __tablename__ = 'pontos'
     
     id = db.Column(db.Integer, primary_key=True)
-    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
+    # Um registro de pontos por cliente; o índice único é o alvo do upsert em atualizar_pontos_cliente
+    cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False, unique=True, index=True)
     pontos_acumulados = db.Column(db.Integer, default=0)
-    nivel_atual = db.Column(db.Enum(NivelEnum), default=NivelEnum.BRONZE)
+    nivel_atual = db.Column(enum_coluna(NivelEnum), default=NivelEnum.BRONZE, index=True)
     data_atualizacao = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    # Relacionamentos
+    cliente = db.relationship('Cliente', back_populates='pontos')
 
     def __repr__(self):
         return f'<Ponto {self.cliente_id} - {self.pontos_acumulados}>'
@@ -92,18 +150,27 @@ class Ponto(db.Model):
             'id': self.id,
             'cliente_id': self.cliente_id,
             'pontos_acumulados': self.pontos_acumulados,
-            'nivel_atual': self.nivel_atual.value,
-            'data_atualizacao': self.data_atualizacao.isoformat() if self.data_atualizacao else None
+            'nivel_atual': self.nivel_atual,
+            'data_atualizacao': self.data_atualizacao
         }
 
 class Produto(db.Model):
     __tablename__ = 'produtos'
+    __table_args__ = (
+        db.Index(
+            'produtos_nome_trgm', 'nome',
+            postgresql_using='gin', postgresql_ops={'nome': 'gin_trgm_ops'}
+        ).ddl_if(dialect='postgresql'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     sku = db.Column(db.String(50), unique=True, nullable=False)
     nome = db.Column(db.String(200), nullable=False)
     descricao = db.Column(db.Text, nullable=True)
     url_imagem = db.Column(db.String(500), nullable=True)
+    
+    # Relacionamentos
+    brindes = db.relationship('Brinde', back_populates='produto', lazy=True)
 
     def __repr__(self):
         return f'<Produto {self.nome}>'
@@ -119,10 +186,17 @@ class Produto(db.Model):
 
 class Campanha(db.Model):
     __tablename__ = 'campanhas'
+    __table_args__ = (
+        # listar_campanhas filtra por ativa/loja e ordena por data_inicio desc
+        db.Index('campanhas_ativa_inicio', 'ativa', db.text('data_inicio DESC')),
+        db.Index('campanhas_loja_inicio', 'loja', db.text('data_inicio DESC')),
+        # Campanha vigente da loja (fator de pontuação a cada visita)
+        db.Index('campanhas_loja_vigencia', 'loja', 'ativa', 'data_inicio', 'data_fim'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     nome = db.Column(db.String(200), nullable=False)
-    loja = db.Column(db.Enum(LojaEnum), nullable=True)  # null = global
+    loja = db.Column(enum_coluna(LojaEnum), nullable=True)  # null = global
     data_inicio = db.Column(db.DateTime, nullable=False)
     data_fim = db.Column(db.DateTime, nullable=False)
     ativa = db.Column(db.Boolean, default=True)
@@ -130,7 +204,7 @@ class Campanha(db.Model):
     fator_pontuacao = db.Column(db.Float, default=1.0)
     
     # Relacionamentos
-    brindes = db.relationship('Brinde', backref='campanha', lazy=True)
+    brindes = db.relationship('Brinde', back_populates='campanha', lazy=True)
 
     def __repr__(self):
         return f'<Campanha {self.nome}>'
@@ -139,9 +213,9 @@ class Campanha(db.Model):
         return {
             'id': self.id,
             'nome': self.nome,
-            'loja': self.loja.value if self.loja else None,
-            'data_inicio': self.data_inicio.isoformat() if self.data_inicio else None,
-            'data_fim': self.data_fim.isoformat() if self.data_fim else None,
+            'loja': self.loja,
+            'data_inicio': self.data_inicio,
+            'data_fim': self.data_fim,
             'ativa': self.ativa,
             'threshold_visitas': self.threshold_visitas,
             'fator_pontuacao': self.fator_pontuacao
@@ -149,15 +223,20 @@ class Campanha(db.Model):
 
 class Brinde(db.Model):
     __tablename__ = 'brindes'
+    __table_args__ = (
+        db.Index('brindes_campanha_nivel', 'campanha_id', 'nivel'),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     produto_id = db.Column(db.Integer, db.ForeignKey('produtos.id'), nullable=False)
     campanha_id = db.Column(db.Integer, db.ForeignKey('campanhas.id'), nullable=False)
-    nivel = db.Column(db.Enum(NivelEnum), nullable=False)
+    nivel = db.Column(enum_coluna(NivelEnum), nullable=False)
     quantidade_disponivel = db.Column(db.Integer, default=0)
     
     # Relacionamentos
-    produto = db.relationship('Produto', backref='brindes')
+    produto = db.relationship('Produto', back_populates='brindes')
+    campanha = db.relationship('Campanha', back_populates='brindes')
+    resgates = db.relationship('Resgate', back_populates='brinde', lazy=True)
 
     def __repr__(self):
         return f'<Brinde {self.nivel.value}>'
@@ -167,24 +246,36 @@ class Brinde(db.Model):
             'id': self.id,
             'produto_id': self.produto_id,
             'campanha_id': self.campanha_id,
-            'nivel': self.nivel.value,
+            'nivel': self.nivel,
             'quantidade_disponivel': self.quantidade_disponivel,
             'produto': self.produto.to_dict() if self.produto else None
         }
 
 class Resgate(db.Model):
     __tablename__ = 'resgates'
+    __table_args__ = (
+        db.Index('resgates_data_status', 'data_resgate', 'status'),
+        db.Index('resgates_brinde_status', 'brinde_id', 'status'),
+        # No máximo um resgate pendente por cliente e brinde (o enum grava o nome do membro)
+        db.Index(
+            'uq_resgate_pendente', 'cliente_id', 'brinde_id', unique=True,
+            sqlite_where=db.text("status = 'PENDENTE'"),
+            postgresql_where=db.text("status = 'PENDENTE'")
+        ),
+    )
     
     id = db.Column(db.Integer, primary_key=True)
     cliente_id = db.Column(db.Integer, db.ForeignKey('clientes.id'), nullable=False)
     brinde_id = db.Column(db.Integer, db.ForeignKey('brindes.id'), nullable=False)
     data_resgate = db.Column(db.DateTime, default=datetime.utcnow)
-    status = db.Column(db.Enum(StatusResgateEnum), default=StatusResgateEnum.PENDENTE)
-    voucher_codigo = db.Column(db.String(100), unique=True, nullable=True)
+    status = db.Column(enum_coluna(StatusResgateEnum), default=StatusResgateEnum.PENDENTE)
+    # VCH-XXXXXXXX-YYYYMMDD; a restrição UNIQUE já é o índice usado por buscar_por_voucher
+    voucher_codigo = db.Column(db.String(32), unique=True, nullable=True)
     data_entrega = db.Column(db.DateTime, nullable=True)
     
     # Relacionamentos
-    brinde = db.relationship('Brinde', backref='resgates')
+    cliente = db.relationship('Cliente', back_populates='resgates')
+    brinde = db.relationship('Brinde', back_populates='resgates')
 
     def __repr__(self):
         return f'<Resgate {self.cliente_id} - {self.status.value}>'
@@ -194,13 +285,251 @@ class Resgate(db.Model):
             'id': self.id,
             'cliente_id': self.cliente_id,
             'brinde_id': self.brinde_id,
-            'data_resgate': self.data_resgate.isoformat() if self.data_resgate else None,
-            'status': self.status.value,
+            'data_resgate': self.data_resgate,
+            'status': self.status,
             'voucher_codigo': self.voucher_codigo,
-            'data_entrega': self.data_entrega.isoformat() if self.data_entrega else None,
+            'data_entrega': self.data_entrega,
             'brinde': self.brinde.to_dict() if self.brinde else None
         }
 
+class DashboardSummary(db.Model):
+    """Totais do dashboard mantidos pelos triggers: linha 'GLOBAL' e uma por mês ('YYYY-MM')"""
+    __tablename__ = 'dashboard_summary'
+    
+    period_key = db.Column(db.String(7), primary_key=True)
+    total_clientes = db.Column(db.Integer, nullable=False, server_default='0')
+    total_visitas = db.Column(db.Integer, nullable=False, server_default='0')
+    total_resgates = db.Column(db.Integer, nullable=False, server_default='0')
+    campanhas_ativas = db.Column(db.Integer, nullable=False, server_default='0')
+    valor_total = db.Column(db.Numeric(14, 2), nullable=False, server_default='0')
+
+    def __repr__(self):
+        return f'<DashboardSummary {self.period_key}>'
+
+class VisitasDaily(db.Model):
+    """Visitas agregadas por dia, mantidas pelos triggers de visitas"""
+    __tablename__ = 'visitas_daily'
+    
+    data = db.Column(db.Date, primary_key=True)
+    total_visitas = db.Column(db.Integer, nullable=False, server_default='0')
+    valor_total = db.Column(db.Numeric(14, 2), nullable=False, server_default='0')
+
+    def __repr__(self):
+        return f'<VisitasDaily {self.data}>'
+
+# Triggers que mantêm clientes.total_visitas, clientes.total_gasto e clientes.pontos_totais
+TRIGGERS_SQLITE = {
+    'visitas': [
+        """CREATE TRIGGER visitas_total_visitas_ins AFTER INSERT ON visitas
+        BEGIN
+            UPDATE clientes SET total_visitas = total_visitas + 1,
+                                total_gasto = ROUND(total_gasto + COALESCE(NEW.valor_compra, 0), 2)
+            WHERE id = NEW.cliente_id;
+        END""",
+        """CREATE TRIGGER visitas_total_visitas_upd AFTER UPDATE OF valor_compra, cliente_id ON visitas
+        BEGIN
+            UPDATE clientes SET total_visitas = total_visitas - 1,
+                                total_gasto = ROUND(total_gasto - COALESCE(OLD.valor_compra, 0), 2)
+            WHERE id = OLD.cliente_id;
+            UPDATE clientes SET total_visitas = total_visitas + 1,
+                                total_gasto = ROUND(total_gasto + COALESCE(NEW.valor_compra, 0), 2)
+            WHERE id = NEW.cliente_id;
+        END""",
+        """CREATE TRIGGER visitas_total_visitas_del AFTER DELETE ON visitas
+        BEGIN
+            UPDATE clientes SET total_visitas = total_visitas - 1,
+                                total_gasto = ROUND(total_gasto - COALESCE(OLD.valor_compra, 0), 2)
+            WHERE id = OLD.cliente_id;
+        END""",
+    ],
+    'pontos': [
+        """CREATE TRIGGER pontos_pontos_totais_ins AFTER INSERT ON pontos
+        BEGIN
+            UPDATE clientes SET pontos_totais = pontos_totais + COALESCE(NEW.pontos_acumulados, 0)
+            WHERE id = NEW.cliente_id;
+        END""",
+        """CREATE TRIGGER pontos_pontos_totais_upd AFTER UPDATE OF pontos_acumulados, cliente_id ON pontos
+        BEGIN
+            UPDATE clientes SET pontos_totais = pontos_totais - COALESCE(OLD.pontos_acumulados, 0)
+            WHERE id = OLD.cliente_id;
+            UPDATE clientes SET pontos_totais = pontos_totais + COALESCE(NEW.pontos_acumulados, 0)
+            WHERE id = NEW.cliente_id;
+        END""",
+        """CREATE TRIGGER pontos_pontos_totais_del AFTER DELETE ON pontos
+        BEGIN
+            UPDATE clientes SET pontos_totais = pontos_totais - COALESCE(OLD.pontos_acumulados, 0)
+            WHERE id = OLD.cliente_id;
+        END""",
+    ],
+}
+
+TRIGGERS_POSTGRESQL = {
+    'visitas': [
+        """CREATE OR REPLACE FUNCTION clientes_total_visitas() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE clientes SET total_visitas = total_visitas - 1,
+                                    total_gasto = total_gasto - COALESCE(OLD.valor_compra, 0)
+                WHERE id = OLD.cliente_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE clientes SET total_visitas = total_visitas + 1,
+                                    total_gasto = total_gasto + COALESCE(NEW.valor_compra, 0)
+                WHERE id = NEW.cliente_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER visitas_total_visitas AFTER INSERT OR DELETE OR UPDATE OF valor_compra, cliente_id
+        ON visitas FOR EACH ROW EXECUTE FUNCTION clientes_total_visitas()""",
+    ],
+    'pontos': [
+        """CREATE OR REPLACE FUNCTION clientes_pontos_totais() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE clientes SET pontos_totais = pontos_totais - COALESCE(OLD.pontos_acumulados, 0)
+                WHERE id = OLD.cliente_id;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                UPDATE clientes SET pontos_totais = pontos_totais + COALESCE(NEW.pontos_acumulados, 0)
+                WHERE id = NEW.cliente_id;
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        """CREATE TRIGGER pontos_pontos_totais AFTER INSERT OR DELETE OR UPDATE OF pontos_acumulados, cliente_id
+        ON pontos FOR EACH ROW EXECUTE FUNCTION clientes_pontos_totais()""",
+    ],
+}
+
+# Soma de valor_total usada nos upserts dos rollups (dashboard_summary e visitas_daily)
+def _soma_valor(dialeto, atual, delta):
+    """Soma de valores monetários; o SQLite guarda NUMERIC como REAL, então arredonda aos centavos"""
+    if dialeto == 'sqlite':
+        return f'ROUND({atual} + {delta}, 2)'
+    return f'{atual} + {delta}'
+
+# Deltas do dashboard_summary por tabela: (coluna que define o mês, colunas de UPDATE, deltas)
+RESUMO_DELTAS = {
+    'clientes': ('data_cadastro', (), {'total_clientes': '1'}),
+    'visitas': ('data_visita', ('valor_compra', 'data_visita'),
+                {'total_visitas': '1', 'valor_total': '{r}.valor_compra'}),
+    'resgates': ('data_resgate', (), {'total_resgates': '1'}),
+    'campanhas': (None, ('ativa',), {'campanhas_ativas': 'CASE WHEN {r}.ativa THEN 1 ELSE 0 END'}),
+}
+
+def _resumo_upserts(dialeto, tabela, registro, sinal):
+    """Upserts que somam (sinal '+') ou subtraem (sinal '-') a linha do registro nos períodos afetados"""
+    coluna_data, _, deltas = RESUMO_DELTAS[tabela]
+    periodos = ["'GLOBAL'"]
+    if coluna_data:
+        data = f'COALESCE({registro}.{coluna_data}, CURRENT_TIMESTAMP)'
+        # '%%' porque o texto passa pela formatação do DDL
+        periodos.append(f"strftime('%%Y-%%m', {data})" if dialeto == 'sqlite' else f"to_char({data}, 'YYYY-MM')")
+    colunas = ', '.join(deltas)
+    valores = ', '.join(f'{sinal}({e.format(r=registro)})' for e in deltas.values())
+    soma = ', '.join(
+        f'{c} = ' + (_soma_valor(dialeto, f'dashboard_summary.{c}', f'excluded.{c}') if c == 'valor_total'
+                     else f'dashboard_summary.{c} + excluded.{c}')
+        for c in deltas
+    )
+    return '\n'.join(
+        f'INSERT INTO dashboard_summary (period_key, {colunas}) VALUES ({periodo}, {valores}) '
+        f'ON CONFLICT (period_key) DO UPDATE SET {soma};'
+        for periodo in periodos
+    )
+
+for tabela, (_, colunas_update, _) in RESUMO_DELTAS.items():
+    TRIGGERS_SQLITE.setdefault(tabela, []).extend([
+        f"""CREATE TRIGGER {tabela}_resumo_ins AFTER INSERT ON {tabela}
+        BEGIN
+            {_resumo_upserts('sqlite', tabela, 'NEW', '+')}
+        END""",
+        f"""CREATE TRIGGER {tabela}_resumo_del AFTER DELETE ON {tabela}
+        BEGIN
+            {_resumo_upserts('sqlite', tabela, 'OLD', '-')}
+        END""",
+    ])
+    if colunas_update:
+        TRIGGERS_SQLITE[tabela].append(
+            f"""CREATE TRIGGER {tabela}_resumo_upd AFTER UPDATE OF {', '.join(colunas_update)} ON {tabela}
+        BEGIN
+            {_resumo_upserts('sqlite', tabela, 'OLD', '-')}
+            {_resumo_upserts('sqlite', tabela, 'NEW', '+')}
+        END"""
+        )
+
+    operacoes = 'INSERT OR DELETE'
+    if colunas_update:
+        operacoes += f" OR UPDATE OF {', '.join(colunas_update)}"
+    TRIGGERS_POSTGRESQL.setdefault(tabela, []).extend([
+        f"""CREATE OR REPLACE FUNCTION dashboard_summary_{tabela}() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                {_resumo_upserts('postgresql', tabela, 'OLD', '-')}
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                {_resumo_upserts('postgresql', tabela, 'NEW', '+')}
+            END IF;
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql""",
+        f"""CREATE TRIGGER {tabela}_resumo AFTER {operacoes}
+        ON {tabela} FOR EACH ROW EXECUTE FUNCTION dashboard_summary_{tabela}()""",
+    ])
+
+def _visitas_daily_upsert(dialeto, registro, sinal):
+    """Upsert que soma ou subtrai a visita do registro no total do seu dia"""
+    data = f'COALESCE({registro}.data_visita, CURRENT_TIMESTAMP)'
+    dia = f'date({data})' if dialeto == 'sqlite' else f'CAST({data} AS DATE)'
+    return (
+        f'INSERT INTO visitas_daily (data, total_visitas, valor_total) '
+        f'VALUES ({dia}, {sinal}1, {sinal}{registro}.valor_compra) '
+        f'ON CONFLICT (data) DO UPDATE SET total_visitas = visitas_daily.total_visitas + excluded.total_visitas, '
+        f"valor_total = {_soma_valor(dialeto, 'visitas_daily.valor_total', 'excluded.valor_total')};"
+    )
+
+TRIGGERS_SQLITE['visitas'].extend([
+    f"""CREATE TRIGGER visitas_daily_ins AFTER INSERT ON visitas
+    BEGIN
+        {_visitas_daily_upsert('sqlite', 'NEW', '+')}
+    END""",
+    f"""CREATE TRIGGER visitas_daily_del AFTER DELETE ON visitas
+    BEGIN
+        {_visitas_daily_upsert('sqlite', 'OLD', '-')}
+    END""",
+    f"""CREATE TRIGGER visitas_daily_upd AFTER UPDATE OF valor_compra, data_visita ON visitas
+    BEGIN
+        {_visitas_daily_upsert('sqlite', 'OLD', '-')}
+        {_visitas_daily_upsert('sqlite', 'NEW', '+')}
+    END""",
+])
+
+TRIGGERS_POSTGRESQL['visitas'].extend([
+    f"""CREATE OR REPLACE FUNCTION visitas_daily_total() RETURNS trigger AS $$
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            {_visitas_daily_upsert('postgresql', 'OLD', '-')}
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            {_visitas_daily_upsert('postgresql', 'NEW', '+')}
+        END IF;
+        RETURN NULL;
+    END
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER visitas_daily AFTER INSERT OR DELETE OR UPDATE OF valor_compra, data_visita
+    ON visitas FOR EACH ROW EXECUTE FUNCTION visitas_daily_total()""",
+])
+
+for dialeto, triggers in (('sqlite', TRIGGERS_SQLITE), ('postgresql', TRIGGERS_POSTGRESQL)):
+    for tabela, comandos in triggers.items():
+        for comando in comandos:
+            event.listen(
+                db.metadata.tables[tabela],
+                'after_create',
+                DDL(comando).execute_if(dialect=dialeto)
+            )
+
 # Classe User mantida para compatibilidade com o template
 class User(db.Model):
     id = db.Column(db.Integer, primary_key=True)
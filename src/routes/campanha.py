@@ -1,19 +1,27 @@
 from flask import Blueprint, request, jsonify
-from src.models.user import db, Campanha, Brinde, Produto, LojaEnum, NivelEnum
-from datetime import datetime
+from src.models.user import db, dialect_insert, Campanha, Brinde, Produto, LojaEnum, NivelEnum
+from src.models.schemas import CampanhaCreate, CampanhaUpdate, BrindeCreate, mensagem_erro
+from src.routes.paginacao import paginar
+from src.cache import cache_resposta, invalidar
+from pydantic import ValidationError
+from sqlalchemy import select, exists, and_
+from sqlalchemy.orm import joinedload, selectinload, raiseload
 
 campanha_bp = Blueprint('campanha', __name__)
 
 @campanha_bp.route('/campanhas', methods=['GET'])
+@cache_resposta('campanhas')
 def listar_campanhas():
     """Lista todas as campanhas"""
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
+        cursor = request.args.get('cursor')
         ativa_filter = request.args.get('ativa')
         loja_filter = request.args.get('loja')
         
-        query = Campanha.query
+        # Linhas Core (sem objetos ORM/identity map); as colunas coincidem com to_dict()
+        query = db.session.query(*Campanha.__table__.columns)
         
         if ativa_filter is not None:
             ativa = ativa_filter.lower() == 'true'
@@ -26,14 +34,17 @@ def listar_campanhas():
             except ValueError:
                 return jsonify({'error': 'Loja inválida'}), 400
         
-        campanhas = query.order_by(Campanha.data_inicio.desc())\
-                         .paginate(page=page, per_page=per_page, error_out=False)
+        try:
+            campanhas, paginacao = paginar(
+                query, (Campanha.data_inicio, Campanha.id),
+                page, per_page, cursor, descendente=True
+            )
+        except ValueError:
+            return jsonify({'error': 'Cursor inválido'}), 400
         
         return jsonify({
-            'campanhas': [campanha.to_dict() for campanha in campanhas.items],
-            'total': campanhas.total,
-            'pages': campanhas.pages,
-            'current_page': page
+            'campanhas': [campanha._asdict() for campanha in campanhas],
+            **paginacao
         })
         
     except Exception as e:
@@ -43,41 +54,20 @@ def listar_campanhas():
 def criar_campanha():
     """Cria uma nova campanha"""
     try:
-        data = request.get_json()
-        
-        # Validações
-        required_fields = ['nome', 'data_inicio', 'data_fim']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} é obrigatório'}), 400
-        
-        data_inicio = datetime.fromisoformat(data['data_inicio'])
-        data_fim = datetime.fromisoformat(data['data_fim'])
+        try:
+            payload = CampanhaCreate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
         
-        if data_inicio >= data_fim:
+        if payload.data_inicio >= payload.data_fim:
             return jsonify({'error': 'Data de início deve ser anterior à data de fim'}), 400
         
-        # Processar loja
-        loja = None
-        if data.get('loja'):
-            try:
-                loja = LojaEnum(data['loja'])
-            except ValueError:
-                return jsonify({'error': 'Loja inválida'}), 400
-        
         # Criar campanha
-        campanha = Campanha(
-            nome=data['nome'],
-            loja=loja,
-            data_inicio=data_inicio,
-            data_fim=data_fim,
-            ativa=data.get('ativa', True),
-            threshold_visitas=data.get('threshold_visitas', 5),
-            fator_pontuacao=data.get('fator_pontuacao', 1.0)
-        )
+        campanha = Campanha(**payload.model_dump())
         
         db.session.add(campanha)
         db.session.commit()
+        invalidar('campanhas', 'dashboard')
         
         return jsonify(campanha.to_dict()), 201
         
@@ -89,7 +79,15 @@ def criar_campanha():
 def obter_campanha(campanha_id):
     """Obtém uma campanha específica"""
     try:
-        campanha = Campanha.query.get_or_404(campanha_id)
+        # Brindes e produtos carregados em lote; qualquer lazy load extra falha
+        campanha = db.one_or_404(
+            select(Campanha)
+            .options(
+                selectinload(Campanha.brindes).selectinload(Brinde.produto),
+                raiseload('*')
+            )
+            .filter_by(id=campanha_id)
+        )
         
         # Incluir brindes da campanha
         campanha_dict = campanha.to_dict()
@@ -105,39 +103,22 @@ def atualizar_campanha(campanha_id):
     """Atualiza uma campanha existente"""
     try:
         campanha = Campanha.query.get_or_404(campanha_id)
-        data = request.get_json()
-        
-        if 'nome' in data:
-            campanha.nome = data['nome']
         
-        if 'data_inicio' in data:
-            campanha.data_inicio = datetime.fromisoformat(data['data_inicio'])
+        try:
+            payload = CampanhaUpdate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
         
-        if 'data_fim' in data:
-            campanha.data_fim = datetime.fromisoformat(data['data_fim'])
+        # Atualização parcial: apenas os campos enviados
+        for campo, valor in payload.model_dump(exclude_unset=True).items():
+            setattr(campanha, campo, valor)
         
         if campanha.data_inicio >= campanha.data_fim:
+            db.session.rollback()
             return jsonify({'error': 'Data de início deve ser anterior à data de fim'}), 400
         
-        if 'loja' in data:
-            if data['loja']:
-                try:
-                    campanha.loja = LojaEnum(data['loja'])
-                except ValueError:
-                    return jsonify({'error': 'Loja inválida'}), 400
-            else:
-                campanha.loja = None
-        
-        if 'ativa' in data:
-            campanha.ativa = data['ativa']
-        
-        if 'threshold_visitas' in data:
-            campanha.threshold_visitas = data['threshold_visitas']
-        
-        if 'fator_pontuacao' in data:
-            campanha.fator_pontuacao = data['fator_pontuacao']
-        
         db.session.commit()
+        invalidar('campanhas', 'dashboard')
         return jsonify(campanha.to_dict())
         
     except Exception as e:
@@ -152,16 +133,19 @@ def excluir_campanha(campanha_id):
         
         # Verificar se há resgates vinculados aos brindes desta campanha
         from src.models.user import Resgate
-        resgates_vinculados = db.session.query(Resgate)\
-                                      .join(Brinde)\
-                                      .filter(Brinde.campanha_id == campanha_id)\
-                                      .count()
-        
-        if resgates_vinculados > 0:
+        resgates_vinculados = db.session.query(
+            exists().where(and_(
+                Resgate.brinde_id == Brinde.id,
+                Brinde.campanha_id == campanha_id
+            ))
+        ).scalar()
+        
+        if resgates_vinculados:
             return jsonify({'error': 'Não é possível excluir campanha com resgates vinculados'}), 400
         
         db.session.delete(campanha)
         db.session.commit()
+        invalidar('campanhas', 'dashboard')
         
         return jsonify({'message': 'Campanha excluída com sucesso'})
         
@@ -171,26 +155,31 @@ def excluir_campanha(campanha_id):
 
 # Rotas para Produtos
 @campanha_bp.route('/produtos', methods=['GET'])
+@cache_resposta('produtos')
 def listar_produtos():
     """Lista todos os produtos"""
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 20, type=int)
+        cursor = request.args.get('cursor')
         nome_filter = request.args.get('nome', '')
         
-        query = Produto.query
+        # Linhas Core (sem objetos ORM/identity map); as colunas coincidem com to_dict()
+        query = db.session.query(*Produto.__table__.columns)
         
         if nome_filter:
             query = query.filter(Produto.nome.ilike(f'%{nome_filter}%'))
         
-        produtos = query.order_by(Produto.nome)\
-                       .paginate(page=page, per_page=per_page, error_out=False)
+        try:
+            produtos, paginacao = paginar(
+                query, (Produto.nome, Produto.id), page, per_page, cursor
+            )
+        except ValueError:
+            return jsonify({'error': 'Cursor inválido'}), 400
         
         return jsonify({
-            'produtos': [produto.to_dict() for produto in produtos.items],
-            'total': produtos.total,
-            'pages': produtos.pages,
-            'current_page': page
+            'produtos': [produto._asdict() for produto in produtos],
+            **paginacao
         })
         
     except Exception as e:
@@ -206,20 +195,22 @@ def criar_produto():
         if not data.get('sku') or not data.get('nome'):
             return jsonify({'error': 'SKU e nome são obrigatórios'}), 400
         
-        # Verificar se SKU já existe
-        produto_existente = Produto.query.filter_by(sku=data['sku']).first()
-        if produto_existente:
-            return jsonify({'error': 'SKU já cadastrado'}), 400
+        # SKU duplicado é detectado atomicamente pelo ON CONFLICT
+        produto = db.session.scalars(
+            dialect_insert(Produto).values(
+                sku=data['sku'],
+                nome=data['nome'],
+                descricao=data.get('descricao'),
+                url_imagem=data.get('url_imagem')
+            ).on_conflict_do_nothing(index_elements=['sku']).returning(Produto)
+        ).first()
         
-        produto = Produto(
-            sku=data['sku'],
-            nome=data['nome'],
-            descricao=data.get('descricao'),
-            url_imagem=data.get('url_imagem')
-        )
+        if not produto:
+            db.session.rollback()
+            return jsonify({'error': 'SKU já cadastrado'}), 400
         
-        db.session.add(produto)
         db.session.commit()
+        invalidar('produtos')
         
         return jsonify(produto.to_dict()), 201
         
@@ -235,7 +226,7 @@ def listar_brindes():
         campanha_id = request.args.get('campanha_id', type=int)
         nivel = request.args.get('nivel')
         
-        query = Brinde.query
+        query = Brinde.query.options(joinedload(Brinde.produto), raiseload('*'))
         
         if campanha_id:
             query = query.filter(Brinde.campanha_id == campanha_id)
@@ -260,35 +251,21 @@ def listar_brindes():
 def criar_brinde():
     """Cria um novo brinde"""
     try:
-        data = request.get_json()
-        
-        # Validações
-        required_fields = ['produto_id', 'campanha_id', 'nivel']
-        for field in required_fields:
-            if not data.get(field):
-                return jsonify({'error': f'{field} é obrigatório'}), 400
+        try:
+            payload = BrindeCreate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
         
         # Verificar se produto e campanha existem
-        produto = Produto.query.get(data['produto_id'])
+        produto = Produto.query.get(payload.produto_id)
         if not produto:
             return jsonify({'error': 'Produto não encontrado'}), 404
         
-        campanha = Campanha.query.get(data['campanha_id'])
+        campanha = Campanha.query.get(payload.campanha_id)
         if not campanha:
             return jsonify({'error': 'Campanha não encontrada'}), 404
         
-        # Validar nível
-        try:
-            nivel_enum = NivelEnum(data['nivel'])
-        except ValueError:
-            return jsonify({'error': 'Nível inválido'}), 400
-        
-        brinde = Brinde(
-            produto_id=data['produto_id'],
-            campanha_id=data['campanha_id'],
-            nivel=nivel_enum,
-            quantidade_disponivel=data.get('quantidade_disponivel', 0)
-        )
+        brinde = Brinde(**payload.model_dump())
         
         db.session.add(brinde)
         db.session.commit()
@@ -330,9 +307,11 @@ def excluir_brinde(brinde_id):
         
         # Verificar se há resgates vinculados
         from src.models.user import Resgate
-        resgates_vinculados = Resgate.query.filter_by(brinde_id=brinde_id).count()
+        resgates_vinculados = db.session.query(
+            Resgate.query.filter_by(brinde_id=brinde_id).exists()
+        ).scalar()
         
-        if resgates_vinculados > 0:
+        if resgates_vinculados:
             return jsonify({'error': 'Não é possível excluir brinde com resgates vinculados'}), 400
         
         db.session.delete(brinde)
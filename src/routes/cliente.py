@@ -1,49 +1,68 @@
 from flask import Blueprint, request, jsonify
-from src.models.user import db, Cliente, Visita, Ponto, NivelEnum
-from datetime import datetime
+from src.models.user import db, dialect_insert, Cliente, Ponto
+from src.models.schemas import ClienteCreate, mensagem_erro
+from src.routes.paginacao import paginar
+from src.routes.visita import calcular_nivel_por_pontos
+from src.cache import invalidar
+from src.tasks import fila, criar_ponto_inicial
+from pydantic import ValidationError
+from functools import lru_cache
 import re
 
 cliente_bp = Blueprint('cliente', __name__)
 
+# Remove tudo que não é dígito ASCII via str.translate (loop em C, sem regex)
+_NAO_DIGITOS = str.maketrans('', '', ''.join(
+    chr(c) for c in range(256) if not '0' <= chr(c) <= '9'
+))
+_NAO_DIGITOS_RE = re.compile(r'[^0-9]')
+
+def _somente_digitos(valor):
+    """Mantém apenas os dígitos 0-9 do valor"""
+    digitos = valor.translate(_NAO_DIGITOS)
+    if digitos.isascii():
+        return digitos
+    # Caracteres fora do Latin-1 não são cobertos pela tabela
+    return _NAO_DIGITOS_RE.sub('', digitos)
+
+@lru_cache(maxsize=4096)
 def validar_cpf(cpf):
     """Validação básica de CPF (apenas formato)"""
-    cpf = re.sub(r'[^0-9]', '', cpf)
+    cpf = _somente_digitos(cpf)
     return len(cpf) == 11 and cpf.isdigit()
 
-def calcular_nivel_por_pontos(pontos):
-    """Calcula o nível baseado na pontuação"""
-    if pontos >= 1000:
-        return NivelEnum.OURO
-    elif pontos >= 500:
-        return NivelEnum.PRATA
-    else:
-        return NivelEnum.BRONZE
-
 @cliente_bp.route('/clientes', methods=['GET'])
 def listar_clientes():
     """Lista todos os clientes com filtros opcionais"""
     try:
         page = request.args.get('page', 1, type=int)
         per_page = request.args.get('per_page', 10, type=int)
+        cursor = request.args.get('cursor')
         nome_filter = request.args.get('nome', '')
         cpf_filter = request.args.get('cpf', '')
         
-        query = Cliente.query
+        # Linhas Core (sem objetos ORM/identity map); as colunas coincidem com to_dict()
+        query = db.session.query(*Cliente.__table__.columns)
         
         if nome_filter:
             query = query.filter(Cliente.nome.ilike(f'%{nome_filter}%'))
         if cpf_filter:
-            query = query.filter(Cliente.cpf.like(f'%{cpf_filter}%'))
-        
-        clientes = query.paginate(
-            page=page, per_page=per_page, error_out=False
-        )
+            # Busca por prefixo como intervalo, atendida pelo índice único de cpf
+            cpf_prefixo = _somente_digitos(cpf_filter)
+            if cpf_prefixo:
+                cpf_limite = cpf_prefixo[:-1] + chr(ord(cpf_prefixo[-1]) + 1)
+                query = query.filter(Cliente.cpf >= cpf_prefixo, Cliente.cpf < cpf_limite)
+            else:
+                query = query.filter(db.false())
+        
+        try:
+            clientes, paginacao = paginar(query, (Cliente.id,), page, per_page, cursor)
+        except ValueError:
+            return jsonify({'error': 'Cursor inválido'}), 400
         
         return jsonify({
-            'clientes': [cliente.to_dict() for cliente in clientes.items],
-            'total': clientes.total,
-            'pages': clientes.pages,
-            'current_page': page
+            'clientes': [cliente._asdict() for cliente in clientes],
+            **paginacao
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
@@ -52,42 +71,52 @@ def listar_clientes():
 def criar_cliente():
     """Cria um novo cliente"""
     try:
-        data = request.get_json()
-        
-        # Validações
-        if not data.get('cpf') or not data.get('nome') or not data.get('telefone'):
-            return jsonify({'error': 'CPF, nome e telefone são obrigatórios'}), 400
+        try:
+            payload = ClienteCreate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
         
-        cpf = re.sub(r'[^0-9]', '', data['cpf'])
+        cpf = _somente_digitos(payload.cpf)
         if not validar_cpf(cpf):
             return jsonify({'error': 'CPF inválido'}), 400
         
-        # Verificar se CPF já existe
-        cliente_existente = Cliente.query.filter_by(cpf=cpf).first()
-        if cliente_existente:
-            return jsonify({'error': 'CPF já cadastrado'}), 400
-        
-        # Criar cliente
-        cliente = Cliente(
-            cpf=cpf,
-            nome=data['nome'],
-            telefone=data['telefone'],
-            email=data.get('email') if not data.get('sem_email') else None,
-            sem_email=data.get('sem_email', False)
-        )
+        # Criar cliente; CPF duplicado é detectado atomicamente pelo ON CONFLICT
+        cliente = db.session.scalars(
+            dialect_insert(Cliente).values(
+                cpf=cpf,
+                nome=payload.nome,
+                telefone=payload.telefone,
+                email=payload.email if not payload.sem_email else None,
+                sem_email=payload.sem_email
+            ).on_conflict_do_nothing(index_elements=['cpf']).returning(Cliente)
+        ).first()
         
-        db.session.add(cliente)
-        db.session.flush()  # Para obter o ID
+        if not cliente:
+            db.session.rollback()
+            return jsonify({'error': 'CPF já cadastrado'}), 400
         
-        # Criar registro de pontos inicial
-        ponto = Ponto(
-            cliente_id=cliente.id,
-            pontos_acumulados=0,
-            nivel_atual=NivelEnum.BRONZE
+        # Registro de pontos inicial: via fila quando houver worker, senão na mesma transação
+        if fila is not None:
+            db.session.commit()
+            try:
+                fila.enqueue(criar_ponto_inicial, cliente.id)
+            except Exception:
+                # Fila indisponível (Redis fora do ar): o cliente já está gravado, o Ponto é criado aqui
+                pass
+            else:
+                invalidar('dashboard')
+                return jsonify(cliente.to_dict()), 201
+        
+        # ON CONFLICT: um job que tenha chegado à fila apesar do erro não duplica o registro
+        db.session.execute(
+            dialect_insert(Ponto).values(
+                cliente_id=cliente.id,
+                pontos_acumulados=0,
+                nivel_atual=calcular_nivel_por_pontos(0)
+            ).on_conflict_do_nothing(index_elements=['cliente_id'])
         )
-        
-        db.session.add(ponto)
         db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard')
         
         return jsonify(cliente.to_dict()), 201
     except Exception as e:
@@ -118,7 +147,7 @@ def atualizar_cliente(cliente_id):
         
         # Validações
         if 'cpf' in data:
-            cpf = re.sub(r'[^0-9]', '', data['cpf'])
+            cpf = _somente_digitos(data['cpf'])
             if not validar_cpf(cpf):
                 return jsonify({'error': 'CPF inválido'}), 400
             
@@ -144,6 +173,7 @@ def atualizar_cliente(cliente_id):
                 cliente.email = None
         
         db.session.commit()
+        invalidar('dashboard')
         return jsonify(cliente.to_dict())
     except Exception as e:
         db.session.rollback()
@@ -157,16 +187,19 @@ def excluir_cliente(cliente_id):
         
         # Verificar se há resgates pendentes
         from src.models.user import Resgate, StatusResgateEnum
-        resgates_pendentes = Resgate.query.filter_by(
-            cliente_id=cliente_id,
-            status=StatusResgateEnum.PENDENTE
-        ).count()
-        
-        if resgates_pendentes > 0:
+        resgates_pendentes = db.session.query(
+            Resgate.query.filter_by(
+                cliente_id=cliente_id,
+                status=StatusResgateEnum.PENDENTE
+            ).exists()
+        ).scalar()
+        
+        if resgates_pendentes:
             return jsonify({'error': 'Não é possível excluir cliente com resgates pendentes'}), 400
         
         db.session.delete(cliente)
         db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard')
         
         return jsonify({'message': 'Cliente excluído com sucesso'})
     except Exception as e:
@@ -177,7 +210,7 @@ def excluir_cliente(cliente_id):
 def buscar_por_cpf(cpf):
     """Busca cliente por CPF"""
     try:
-        cpf = re.sub(r'[^0-9]', '', cpf)
+        cpf = _somente_digitos(cpf)
         cliente = Cliente.query.filter_by(cpf=cpf).first()
         
         if not cliente:
@@ -1,58 +1,43 @@
-from flask import Blueprint, request, jsonify
-from src.models.user import db, Cliente, Visita, Ponto, Resgate, Brinde, Campanha, StatusResgateEnum, NivelEnum
-from datetime import datetime, timedelta
-from sqlalchemy import func, desc
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.models.user import db, Cliente, Visita, Ponto, Resgate, Brinde, Campanha, DashboardSummary, VisitasDaily, StatusResgateEnum, NivelEnum
+from src.cache import cache_resposta
+from src.routes.datas import intervalo_datas
+from src.serializacao import json_default
+from datetime import datetime
+import orjson
+from sqlalchemy import Integer, func, case, cast, and_, or_
+from sqlalchemy.orm import selectinload
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
 @dashboard_bp.route('/dashboard/resumo', methods=['GET'])
+@cache_resposta('dashboard')
 def resumo_dashboard():
     """Retorna resumo geral para o dashboard"""
     try:
-        # Estatísticas gerais
-        total_clientes = Cliente.query.count()
-        total_visitas = Visita.query.count()
-        total_resgates = Resgate.query.count()
-        campanhas_ativas = Campanha.query.filter_by(ativa=True).count()
-        
-        # Estatísticas do mês atual
-        inicio_mes = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        fim_mes = (inicio_mes + timedelta(days=32)).replace(day=1) - timedelta(days=1)
-        
-        visitas_mes = Visita.query.filter(
-            Visita.data_visita >= inicio_mes,
-            Visita.data_visita <= fim_mes
-        ).count()
-        
-        novos_clientes_mes = Cliente.query.filter(
-            Cliente.data_cadastro >= inicio_mes,
-            Cliente.data_cadastro <= fim_mes
-        ).count()
-        
-        resgates_mes = Resgate.query.filter(
-            Resgate.data_resgate >= inicio_mes,
-            Resgate.data_resgate <= fim_mes
-        ).count()
-        
-        # Valor total de compras do mês
-        valor_total_mes = db.session.query(func.sum(Visita.valor_compra))\
-                                   .filter(
-                                       Visita.data_visita >= inicio_mes,
-                                       Visita.data_visita <= fim_mes
-                                   ).scalar() or 0
+        # Totais mantidos pelos triggers do dashboard_summary: duas leituras por chave primária
+        mes_atual = datetime.now().strftime('%Y-%m')
+        linhas = db.session.query(*DashboardSummary.__table__.columns)\
+                           .filter(DashboardSummary.period_key.in_(('GLOBAL', mes_atual)))
+        resumo = {linha.period_key: linha for linha in linhas}
+        
+        zerado = DashboardSummary(total_clientes=0, total_visitas=0, total_resgates=0,
+                                  campanhas_ativas=0, valor_total=0)
+        geral = resumo.get('GLOBAL', zerado)
+        mes = resumo.get(mes_atual, zerado)
         
         return jsonify({
             'estatisticas_gerais': {
-                'total_clientes': total_clientes,
-                'total_visitas': total_visitas,
-                'total_resgates': total_resgates,
-                'campanhas_ativas': campanhas_ativas
+                'total_clientes': geral.total_clientes,
+                'total_visitas': geral.total_visitas,
+                'total_resgates': geral.total_resgates,
+                'campanhas_ativas': geral.campanhas_ativas
             },
             'estatisticas_mes': {
-                'visitas_mes': visitas_mes,
-                'novos_clientes_mes': novos_clientes_mes,
-                'resgates_mes': resgates_mes,
-                'valor_total_mes': float(valor_total_mes)
+                'visitas_mes': mes.total_visitas,
+                'novos_clientes_mes': mes.total_clientes,
+                'resgates_mes': mes.total_resgates,
+                'valor_total_mes': float(mes.valor_total)
             }
         })
         
@@ -60,61 +45,99 @@ def resumo_dashboard():
         return jsonify({'error': str(e)}), 500
 
 @dashboard_bp.route('/dashboard/top-clientes', methods=['GET'])
+@cache_resposta('dashboard')
 def top_clientes():
     """Retorna top 10 clientes por diferentes critérios"""
     try:
-        # Top 10 por pontuação
-        top_pontos = db.session.query(Cliente, Ponto)\
-                              .join(Ponto)\
-                              .order_by(desc(Ponto.pontos_acumulados))\
-                              .limit(10)\
-                              .all()
-        
-        # Top 10 por número de visitas
-        top_visitas = db.session.query(Cliente, func.count(Visita.id).label('total_visitas'))\
-                               .join(Visita)\
-                               .group_by(Cliente.id)\
-                               .order_by(desc('total_visitas'))\
-                               .limit(10)\
-                               .all()
-        
-        # Top 10 por valor de compras
-        top_valor = db.session.query(Cliente, func.sum(Visita.valor_compra).label('valor_total'))\
-                             .join(Visita)\
-                             .group_by(Cliente.id)\
-                             .order_by(desc('valor_total'))\
-                             .limit(10)\
-                             .all()
+        # Visitas agregadas por cliente uma única vez
+        visitas = db.session.query(
+            Visita.cliente_id,
+            func.count(Visita.id).label('total_visitas'),
+            func.sum(Visita.valor_compra).label('valor_total')
+        ).group_by(Visita.cliente_id).subquery()
+        
+        total_visitas = func.coalesce(visitas.c.total_visitas, 0)
+        valor_total = func.coalesce(visitas.c.valor_total, 0)
+        
+        # Os três rankings calculados sobre o mesmo agregado
+        ranking = db.session.query(
+            Cliente.id.label('cliente_id'),
+            Ponto.id.label('ponto_id'),
+            Ponto.pontos_acumulados,
+            Ponto.nivel_atual,
+            total_visitas.label('total_visitas'),
+            valor_total.label('valor_total'),
+            func.row_number().over(order_by=Ponto.pontos_acumulados.desc().nulls_last()).label('rank_pontos'),
+            func.row_number().over(order_by=total_visitas.desc()).label('rank_visitas'),
+            func.row_number().over(order_by=valor_total.desc()).label('rank_valor')
+        ).outerjoin(Ponto, Ponto.cliente_id == Cliente.id)\
+         .outerjoin(visitas, visitas.c.cliente_id == Cliente.id)\
+         .subquery()
+        
+        linhas = db.session.query(ranking).filter(or_(
+            ranking.c.rank_pontos <= 10,
+            ranking.c.rank_visitas <= 10,
+            ranking.c.rank_valor <= 10
+        )).all()
+        
+        clientes = {
+            cliente.id: cliente.to_dict()
+            for cliente in Cliente.query.filter(Cliente.id.in_({linha.cliente_id for linha in linhas}))
+        }
+        
+        def top(rank, incluir):
+            return sorted(
+                (linha for linha in linhas if getattr(linha, rank) <= 10 and incluir(linha)),
+                key=lambda linha: getattr(linha, rank)
+            )
         
         return jsonify({
             'top_pontos': [
                 {
-                    'cliente': cliente.to_dict(),
-                    'pontos': ponto.pontos_acumulados,
-                    'nivel': ponto.nivel_atual.value
+                    'cliente': clientes[linha.cliente_id],
+                    'pontos': linha.pontos_acumulados,
+                    'nivel': linha.nivel_atual
                 }
-                for cliente, ponto in top_pontos
+                for linha in top('rank_pontos', lambda linha: linha.ponto_id is not None)
             ],
             'top_visitas': [
                 {
-                    'cliente': cliente.to_dict(),
-                    'total_visitas': int(total_visitas)
+                    'cliente': clientes[linha.cliente_id],
+                    'total_visitas': int(linha.total_visitas)
                 }
-                for cliente, total_visitas in top_visitas
+                for linha in top('rank_visitas', lambda linha: linha.total_visitas > 0)
             ],
             'top_valor': [
                 {
-                    'cliente': cliente.to_dict(),
-                    'valor_total': float(valor_total)
+                    'cliente': clientes[linha.cliente_id],
+                    'valor_total': float(linha.valor_total)
                 }
-                for cliente, valor_total in top_valor
+                for linha in top('rank_valor', lambda linha: linha.total_visitas > 0)
             ]
         })
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def formatar_data(coluna, formato_sqlite, formato_postgresql):
+    """Data formatada como texto no dialeto em uso (strftime no SQLite, to_char no PostgreSQL)"""
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(coluna, formato_postgresql)
+    return func.strftime(formato_sqlite, coluna)
+
+def semana_iso(coluna):
+    """Semana ISO 8601 como 'AAAA-SS' nos dois dialetos (ano ISO, semanas de segunda a domingo).
+
+    O SQLite antigo não tem %G/%V: a semana é derivada da quinta-feira dela, que fica sempre no ano ISO.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        return func.to_char(coluna, 'IYYY-IW')
+    quinta = func.date(coluna, '-3 days', 'weekday 4')
+    semana = (cast(func.strftime('%j', quinta), Integer) - 1) // 7 + 1
+    return func.strftime('%Y', quinta).concat('-').concat(func.printf('%02d', semana))
+
 @dashboard_bp.route('/dashboard/visitas-periodo', methods=['GET'])
+@cache_resposta('dashboard')
 def visitas_por_periodo():
     """Retorna visitas agrupadas por período"""
     try:
@@ -122,43 +145,24 @@ def visitas_por_periodo():
         data_inicio = request.args.get('data_inicio')
         data_fim = request.args.get('data_fim')
         
-        query = Visita.query
-        
-        if data_inicio:
-            query = query.filter(Visita.data_visita >= datetime.fromisoformat(data_inicio))
-        
-        if data_fim:
-            query = query.filter(Visita.data_visita <= datetime.fromisoformat(data_fim))
-        
+        # Agrega sobre o rollup diário (uma linha por dia) em vez das visitas
         if periodo == 'dia':
-            # Agrupar por dia
-            visitas_agrupadas = db.session.query(
-                func.date(Visita.data_visita).label('periodo'),
-                func.count(Visita.id).label('total_visitas'),
-                func.sum(Visita.valor_compra).label('valor_total')
-            ).group_by(func.date(Visita.data_visita))\
-             .order_by('periodo')\
-             .all()
-        
+            chave = VisitasDaily.data
         elif periodo == 'semana':
-            # Agrupar por semana
-            visitas_agrupadas = db.session.query(
-                func.strftime('%Y-%W', Visita.data_visita).label('periodo'),
-                func.count(Visita.id).label('total_visitas'),
-                func.sum(Visita.valor_compra).label('valor_total')
-            ).group_by(func.strftime('%Y-%W', Visita.data_visita))\
-             .order_by('periodo')\
-             .all()
-        
+            chave = semana_iso(VisitasDaily.data)
         else:  # mes
-            # Agrupar por mês
-            visitas_agrupadas = db.session.query(
-                func.strftime('%Y-%m', Visita.data_visita).label('periodo'),
-                func.count(Visita.id).label('total_visitas'),
-                func.sum(Visita.valor_compra).label('valor_total')
-            ).group_by(func.strftime('%Y-%m', Visita.data_visita))\
-             .order_by('periodo')\
-             .all()
+            chave = formatar_data(VisitasDaily.data, '%Y-%m', 'YYYY-MM')
+        
+        query = db.session.query(
+            chave.label('periodo'),
+            func.sum(VisitasDaily.total_visitas).label('total_visitas'),
+            func.sum(VisitasDaily.valor_total).label('valor_total')
+        )
+        
+        query = query.filter(*intervalo_datas(VisitasDaily.data, data_inicio, data_fim))
+        
+        # Agrupa pelo rótulo: no PostgreSQL o formato ligado duas vezes não casaria com o SELECT
+        visitas_agrupadas = query.group_by('periodo').order_by('periodo').all()
         
         return jsonify({
             'periodo': periodo,
@@ -176,6 +180,7 @@ def visitas_por_periodo():
         return jsonify({'error': str(e)}), 500
 
 @dashboard_bp.route('/dashboard/distribuicao-niveis', methods=['GET'])
+@cache_resposta('distribuicao_niveis')
 def distribuicao_niveis():
     """Retorna distribuição de clientes por nível"""
     try:
@@ -187,7 +192,7 @@ def distribuicao_niveis():
         return jsonify({
             'distribuicao': [
                 {
-                    'nivel': nivel.value,
+                    'nivel': nivel,
                     'total': int(total)
                 }
                 for nivel, total in distribuicao
@@ -198,6 +203,7 @@ def distribuicao_niveis():
         return jsonify({'error': str(e)}), 500
 
 @dashboard_bp.route('/dashboard/resgates-status', methods=['GET'])
+@cache_resposta('resgates_status')
 def resgates_por_status():
     """Retorna resgates agrupados por status"""
     try:
@@ -209,7 +215,7 @@ def resgates_por_status():
         return jsonify({
             'resgates_status': [
                 {
-                    'status': status.value,
+                    'status': status,
                     'total': int(total)
                 }
                 for status, total in resgates_status
@@ -229,11 +235,32 @@ def relatorio_clientes_detalhado():
         data_cadastro_fim = request.args.get('data_cadastro_fim')
         min_visitas = request.args.get('min_visitas', type=int)
         min_pontos = request.args.get('min_pontos', type=int)
-        
-        # Query base com joins
-        query = db.session.query(Cliente, Ponto)\
-                         .outerjoin(Ponto)\
-                         .outerjoin(Visita)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 50, type=int), 1)
+        
+        # Resgates pré-agregados por cliente para não multiplicar as linhas de visitas
+        resgates = db.session.query(
+            Resgate.cliente_id,
+            func.sum(case((Resgate.status == StatusResgateEnum.PENDENTE, 1), else_=0)).label('pendentes'),
+            func.sum(case((Resgate.status == StatusResgateEnum.ENTREGUE, 1), else_=0)).label('entregues')
+        ).group_by(Resgate.cliente_id).subquery()
+        
+        total_visitas = func.count(Visita.id)
+        valor_total_compras = func.coalesce(func.sum(Visita.valor_compra), 0)
+        
+        # Todas as estatísticas calculadas no banco em uma única query
+        query = db.session.query(
+            Cliente,
+            Ponto,
+            total_visitas,
+            valor_total_compras,
+            func.max(Visita.data_visita),
+            func.coalesce(func.max(resgates.c.pendentes), 0),
+            func.coalesce(func.max(resgates.c.entregues), 0)
+        ).outerjoin(Ponto, Ponto.cliente_id == Cliente.id)\
+         .outerjoin(Visita, Visita.cliente_id == Cliente.id)\
+         .outerjoin(resgates, resgates.c.cliente_id == Cliente.id)\
+         .group_by(Cliente.id, Ponto.id)
         
         if nivel_filter:
             try:
@@ -242,58 +269,53 @@ def relatorio_clientes_detalhado():
             except ValueError:
                 return jsonify({'error': 'Nível inválido'}), 400
         
-        if data_cadastro_inicio:
-            query = query.filter(Cliente.data_cadastro >= datetime.fromisoformat(data_cadastro_inicio))
+        query = query.filter(*intervalo_datas(Cliente.data_cadastro, data_cadastro_inicio, data_cadastro_fim))
         
-        if data_cadastro_fim:
-            query = query.filter(Cliente.data_cadastro <= datetime.fromisoformat(data_cadastro_fim))
+        if min_visitas:
+            query = query.having(total_visitas >= min_visitas)
         
-        clientes_pontos = query.all()
+        if min_pontos:
+            query = query.filter(func.coalesce(Ponto.pontos_acumulados, 0) >= min_pontos)
         
-        # Processar dados
-        relatorio = []
-        for cliente, ponto in clientes_pontos:
-            # Calcular estatísticas do cliente
-            total_visitas = len(cliente.visitas)
-            valor_total_compras = sum([v.valor_compra for v in cliente.visitas])
-            pontos_totais = ponto.pontos_acumulados if ponto else 0
-            
-            # Aplicar filtros adicionais
-            if min_visitas and total_visitas < min_visitas:
-                continue
-            if min_pontos and pontos_totais < min_pontos:
-                continue
-            
-            # Última visita
-            ultima_visita = None
-            if cliente.visitas:
-                ultima_visita = max(cliente.visitas, key=lambda v: v.data_visita)
-            
-            # Resgates do cliente
-            resgates_pendentes = len([r for r in cliente.resgates if r.status == StatusResgateEnum.PENDENTE])
-            resgates_entregues = len([r for r in cliente.resgates if r.status == StatusResgateEnum.ENTREGUE])
-            
-            relatorio.append({
-                'cliente': cliente.to_dict(),
-                'pontos': {
-                    'total': pontos_totais,
-                    'nivel': ponto.nivel_atual.value if ponto else 'Bronze'
-                },
-                'estatisticas': {
-                    'total_visitas': total_visitas,
-                    'valor_total_compras': valor_total_compras,
-                    'valor_medio_compra': valor_total_compras / total_visitas if total_visitas > 0 else 0,
-                    'ultima_visita': ultima_visita.data_visita.isoformat() if ultima_visita else None,
-                    'resgates_pendentes': resgates_pendentes,
-                    'resgates_entregues': resgates_entregues
-                }
-            })
-        
-        return jsonify({
-            'relatorio': relatorio,
-            'total_clientes': len(relatorio)
+        # Só a página pedida sai do banco; o total conta os grupos já filtrados pelo HAVING
+        total = query.order_by(None).count()
+        pagina = query.order_by(Cliente.id, Ponto.id)\
+                      .limit(per_page)\
+                      .offset((page - 1) * per_page)
+        metadados = orjson.dumps({
+            'total': total,
+            'total_clientes': total,
+            'pages': -(-total // per_page),
+            'current_page': page
         })
         
+        def gerar():
+            # Linhas serializadas uma a uma: memória constante independente do tamanho da página
+            yield b'{"relatorio":['
+            separador = b''
+            for cliente, ponto, visitas, valor_total, ultima_visita, pendentes, entregues in pagina.yield_per(500):
+                valor_total = float(valor_total)
+                linha = orjson.dumps({
+                    'cliente': cliente.to_dict(),
+                    'pontos': {
+                        'total': ponto.pontos_acumulados if ponto else 0,
+                        'nivel': ponto.nivel_atual if ponto else NivelEnum.BRONZE
+                    },
+                    'estatisticas': {
+                        'total_visitas': visitas,
+                        'valor_total_compras': valor_total,
+                        'valor_medio_compra': valor_total / visitas if visitas > 0 else 0,
+                        'ultima_visita': ultima_visita,
+                        'resgates_pendentes': int(pendentes),
+                        'resgates_entregues': int(entregues)
+                    }
+                }, default=json_default)
+                yield separador + linha
+                separador = b','
+            yield b'],' + metadados[1:]
+        
+        return Response(stream_with_context(gerar()), mimetype='application/json')
+        
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -301,43 +323,44 @@ def relatorio_clientes_detalhado():
 def relatorio_campanhas_performance():
     """Relatório de performance das campanhas"""
     try:
-        campanhas = Campanha.query.all()
+        # Resgates por campanha em uma única query agrupada
+        resgates = {
+            campanha_id: (total, entregues, pendentes)
+            for campanha_id, total, entregues, pendentes in db.session.query(
+                Brinde.campanha_id,
+                func.count(Resgate.id),
+                func.sum(case((Resgate.status == StatusResgateEnum.ENTREGUE, 1), else_=0)),
+                func.sum(case((Resgate.status == StatusResgateEnum.PENDENTE, 1), else_=0))
+            ).select_from(Resgate).join(Brinde).group_by(Brinde.campanha_id)
+        }
+        
+        # Visitas no período (e na loja, se houver) de cada campanha
+        visitas = {
+            campanha_id: (total, valor)
+            for campanha_id, total, valor in db.session.query(
+                Campanha.id,
+                func.count(Visita.id),
+                func.coalesce(func.sum(Visita.valor_compra), 0)
+            ).select_from(Campanha).join(Visita, and_(
+                Visita.data_visita >= Campanha.data_inicio,
+                Visita.data_visita <= Campanha.data_fim,
+                or_(Campanha.loja.is_(None), Visita.loja == Campanha.loja)
+            )).group_by(Campanha.id)
+        }
+        
+        campanhas = Campanha.query.options(selectinload(Campanha.brindes)).all()
         
         relatorio_campanhas = []
         
         for campanha in campanhas:
-            # Estatísticas da campanha
-            total_brindes = len(campanha.brindes)
-            brindes_disponiveis = sum([b.quantidade_disponivel for b in campanha.brindes])
-            
-            # Resgates da campanha
-            resgates_campanha = db.session.query(Resgate)\
-                                         .join(Brinde)\
-                                         .filter(Brinde.campanha_id == campanha.id)\
-                                         .all()
-            
-            total_resgates = len(resgates_campanha)
-            resgates_entregues = len([r for r in resgates_campanha if r.status == StatusResgateEnum.ENTREGUE])
-            resgates_pendentes = len([r for r in resgates_campanha if r.status == StatusResgateEnum.PENDENTE])
-            
-            # Visitas no período da campanha
-            visitas_periodo = Visita.query.filter(
-                Visita.data_visita >= campanha.data_inicio,
-                Visita.data_visita <= campanha.data_fim
-            )
-            
-            if campanha.loja:
-                visitas_periodo = visitas_periodo.filter(Visita.loja == campanha.loja)
-            
-            visitas_periodo = visitas_periodo.all()
-            total_visitas_periodo = len(visitas_periodo)
-            valor_total_periodo = sum([v.valor_compra for v in visitas_periodo])
+            total_resgates, resgates_entregues, resgates_pendentes = resgates.get(campanha.id, (0, 0, 0))
+            total_visitas_periodo, valor_total_periodo = visitas.get(campanha.id, (0, 0))
             
             relatorio_campanhas.append({
                 'campanha': campanha.to_dict(),
                 'brindes': {
-                    'total_tipos': total_brindes,
-                    'total_disponivel': brindes_disponiveis
+                    'total_tipos': len(campanha.brindes),
+                    'total_disponivel': sum(b.quantidade_disponivel for b in campanha.brindes)
                 },
                 'resgates': {
                     'total': total_resgates,
@@ -0,0 +1,21 @@
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+
+@lru_cache(maxsize=1024)
+def converter_data(valor):
+    """Converte um parâmetro ISO (data ou data e hora) para o início do dia"""
+    return datetime.fromisoformat(valor).replace(hour=0, minute=0, second=0, microsecond=0)
+
+def intervalo_datas(coluna, inicio=None, fim=None):
+    """Filtros do intervalo semiaberto [inicio, fim + 1 dia): o dia final entra inteiro
+    e a coluna é comparada diretamente, permitindo range scan no índice"""
+    # Colunas DATE recebem date: no SQLite um datetime seria comparado como texto com hora
+    somente_data = coluna.type.python_type is date
+    filtros = []
+    if inicio:
+        limite = converter_data(inicio)
+        filtros.append(coluna >= (limite.date() if somente_data else limite))
+    if fim:
+        limite = converter_data(fim) + timedelta(days=1)
+        filtros.append(coluna < (limite.date() if somente_data else limite))
+    return filtros
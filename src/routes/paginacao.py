@@ -0,0 +1,53 @@
+import base64
+import json
+from datetime import datetime
+from sqlalchemy import tuple_
+
+def codificar_cursor(*valores):
+    """Serializa os valores da chave de ordenação em um cursor opaco"""
+    bruto = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in valores])
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+def decodificar_cursor(cursor, colunas):
+    """Converte o cursor de volta para os tipos Python das colunas (ValueError se inválido)"""
+    valores = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    if not isinstance(valores, list) or len(valores) != len(colunas):
+        raise ValueError('Cursor inválido')
+    return tuple(
+        datetime.fromisoformat(valor) if coluna.type.python_type is datetime else valor
+        for coluna, valor in zip(colunas, valores)
+    )
+
+def paginar(query, colunas, page, per_page, cursor=None, descendente=False):
+    """Pagina a consulta ordenada por `colunas` (a última deve ser única).
+
+    Sem cursor usa OFFSET/LIMIT e informa total e páginas; com cursor usa keyset
+    (`WHERE (colunas) < cursor`), cujo custo não cresce com a página e dispensa o COUNT.
+    Retorna (itens, metadados); levanta ValueError para cursor inválido.
+    """
+    query = query.order_by(*[c.desc() if descendente else c.asc() for c in colunas])
+    
+    if cursor:
+        chave = decodificar_cursor(cursor, colunas)
+        chave_colunas = tuple_(*colunas)
+        query = query.filter(chave_colunas < chave if descendente else chave_colunas > chave)
+        itens = query.limit(per_page + 1).all()
+        tem_proxima = len(itens) > per_page
+        itens = itens[:per_page]
+        metadados = {}
+    else:
+        pagina = query.paginate(page=page, per_page=per_page, error_out=False)
+        itens = pagina.items
+        tem_proxima = pagina.has_next
+        metadados = {
+            'total': pagina.total,
+            'pages': pagina.pages,
+            'current_page': page
+        }
+    
+    proximo_cursor = None
+    if tem_proxima and itens:
+        proximo_cursor = codificar_cursor(*[getattr(itens[-1], c.key) for c in colunas])
+    metadados['next_cursor'] = proximo_cursor
+    
+    return itens, metadados
@@ -1,67 +1,92 @@
 from flask import Blueprint, request, jsonify
-from src.models.user import db, Cliente, Brinde, Resgate, Ponto, StatusResgateEnum, NivelEnum
+from src.models.user import db, Cliente, Brinde, Campanha, Resgate, Ponto, StatusResgateEnum
+from src.cache import invalidar
+from src.routes.datas import intervalo_datas
 from datetime import datetime
-import uuid
-import secrets
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import contains_eager, joinedload, raiseload
+import base64
+import os
+import time
 
 resgate_bp = Blueprint('resgate', __name__)
 
+# Resgate.to_dict() inclui brinde e produto: carregados no mesmo SELECT, demais relações bloqueadas
+CARGA_RESGATE = (joinedload(Resgate.brinde).joinedload(Brinde.produto), raiseload('*'))
+
+# Data do voucher formatada no máximo uma vez por segundo: [timestamp, 'YYYYMMDD']
+_DATA_VOUCHER = [0, '']
+
 def gerar_voucher_codigo():
-    """Gera um código único para o voucher"""
-    return f"VCH-{secrets.token_hex(4).upper()}-{datetime.now().strftime('%Y%m%d')}"
+    """Gera um código único para o voucher (VCH-XXXXXXXX-YYYYMMDD)"""
+    agora = int(time.time())
+    if agora != _DATA_VOUCHER[0]:
+        _DATA_VOUCHER[:] = [agora, time.strftime('%Y%m%d')]
+    # 5 bytes aleatórios = 8 caracteres base32, mesma largura do formato anterior
+    return f"VCH-{base64.b32encode(os.urandom(5)).decode()}-{_DATA_VOUCHER[1]}"
+
+def checar_elegibilidade(campanha, quantidade_disponivel, nivel_brinde, nivel_cliente, total_visitas, agora):
+    """Aplica as regras de elegibilidade sobre valores já carregados (sem acesso ao banco)
+
+    `campanha` é qualquer objeto com ativa, data_inicio, data_fim e threshold_visitas;
+    `nivel_cliente` é None quando o cliente não tem registro de pontos.
+    """
+    # Verificar se a campanha está ativa
+    if not campanha.ativa:
+        return False, "Campanha não está ativa"
+    
+    # Verificar se está dentro do período da campanha
+    if agora < campanha.data_inicio or agora > campanha.data_fim:
+        return False, "Campanha fora do período de validade"
+    
+    # Verificar disponibilidade do brinde
+    if quantidade_disponivel <= 0:
+        return False, "Brinde não disponível"
+    
+    # Verificar pontos do cliente
+    if nivel_cliente is None:
+        return False, "Cliente não possui pontos registrados"
+    
+    # Verificar se o nível do cliente permite o brinde
+    if nivel_cliente.rank < nivel_brinde.rank:
+        return False, f"Nível insuficiente. Necessário: {nivel_brinde.value}, Atual: {nivel_cliente.value}"
+    
+    # Verificar threshold de visitas se configurado
+    if total_visitas < campanha.threshold_visitas:
+        return False, f"Número de visitas insuficiente. Necessário: {campanha.threshold_visitas}, Atual: {total_visitas}"
+    
+    return True, "Cliente elegível"
 
 def verificar_elegibilidade_cliente(cliente_id, brinde_id):
     """Verifica se o cliente é elegível para resgatar o brinde"""
-    try:
-        cliente = Cliente.query.get(cliente_id)
-        if not cliente:
-            return False, "Cliente não encontrado"
-        
-        brinde = Brinde.query.get(brinde_id)
-        if not brinde:
-            return False, "Brinde não encontrado"
-        
-        # Verificar se a campanha está ativa
-        if not brinde.campanha.ativa:
-            return False, "Campanha não está ativa"
-        
-        # Verificar se está dentro do período da campanha
-        agora = datetime.utcnow()
-        if agora < brinde.campanha.data_inicio or agora > brinde.campanha.data_fim:
-            return False, "Campanha fora do período de validade"
-        
-        # Verificar disponibilidade do brinde
-        if brinde.quantidade_disponivel <= 0:
-            return False, "Brinde não disponível"
-        
-        # Verificar pontos do cliente
-        ponto = Ponto.query.filter_by(cliente_id=cliente_id).first()
-        if not ponto:
-            return False, "Cliente não possui pontos registrados"
-        
-        # Verificar se o nível do cliente permite o brinde
-        nivel_cliente = ponto.nivel_atual
-        nivel_brinde = brinde.nivel
-        
-        # Hierarquia: Bronze < Prata < Ouro
-        niveis_hierarquia = {
-            NivelEnum.BRONZE: 1,
-            NivelEnum.PRATA: 2,
-            NivelEnum.OURO: 3
-        }
-        
-        if niveis_hierarquia[nivel_cliente] < niveis_hierarquia[nivel_brinde]:
-            return False, f"Nível insuficiente. Necessário: {nivel_brinde.value}, Atual: {nivel_cliente.value}"
-        
-        # Verificar threshold de visitas se configurado
-        total_visitas = len(cliente.visitas)
-        if total_visitas < brinde.campanha.threshold_visitas:
-            return False, f"Número de visitas insuficiente. Necessário: {brinde.campanha.threshold_visitas}, Atual: {total_visitas}"
-        
-        return True, "Cliente elegível"
-        
-    except Exception as e:
-        return False, f"Erro ao verificar elegibilidade: {str(e)}"
+    # Uma única query de colunas: cliente, brinde, campanha e nível sem hidratar objetos
+    dados = db.session.query(
+        Cliente.total_visitas,
+        Brinde.id.label('brinde_id'),
+        Brinde.quantidade_disponivel,
+        Brinde.nivel,
+        Campanha.ativa,
+        Campanha.data_inicio,
+        Campanha.data_fim,
+        Campanha.threshold_visitas,
+        Ponto.nivel_atual
+    ).select_from(Cliente)\
+     .outerjoin(Brinde, Brinde.id == brinde_id)\
+     .outerjoin(Campanha, Campanha.id == Brinde.campanha_id)\
+     .outerjoin(Ponto, Ponto.cliente_id == Cliente.id)\
+     .filter(Cliente.id == cliente_id)\
+     .first()
+    
+    if not dados:
+        return False, "Cliente não encontrado"
+    
+    if dados.brinde_id is None:
+        return False, "Brinde não encontrado"
+    
+    return checar_elegibilidade(
+        dados, dados.quantidade_disponivel, dados.nivel, dados.nivel_atual,
+        dados.total_visitas, datetime.utcnow()
+    )
 
 @resgate_bp.route('/resgates/verificar-elegibilidade', methods=['POST'])
 def verificar_elegibilidade():
@@ -102,15 +127,18 @@ def criar_resgate():
         if not elegivel:
             return jsonify({'error': mensagem}), 400
         
-        # Verificar se já existe resgate pendente para este cliente e brinde
-        resgate_existente = Resgate.query.filter_by(
-            cliente_id=cliente_id,
-            brinde_id=brinde_id,
-            status=StatusResgateEnum.PENDENTE
-        ).first()
+        # Reduzir quantidade disponível do brinde: UPDATE condicional, sem corrida entre resgates
+        reservado = Brinde.query.filter(
+            Brinde.id == brinde_id,
+            Brinde.quantidade_disponivel > 0
+        ).update(
+            {Brinde.quantidade_disponivel: Brinde.quantidade_disponivel - 1},
+            synchronize_session=False
+        )
         
-        if resgate_existente:
-            return jsonify({'error': 'Já existe um resgate pendente para este brinde'}), 400
+        if not reservado:
+            db.session.rollback()
+            return jsonify({'error': 'Brinde esgotado'}), 409
         
         # Criar resgate
         voucher_codigo = gerar_voucher_codigo()
@@ -124,11 +152,13 @@ def criar_resgate():
         
         db.session.add(resgate)
         
-        # Reduzir quantidade disponível do brinde
-        brinde = Brinde.query.get(brinde_id)
-        brinde.quantidade_disponivel -= 1
-        
-        db.session.commit()
+        # Resgate pendente duplicado é barrado pelo índice único uq_resgate_pendente
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Já existe um resgate pendente para este brinde'}), 400
+        invalidar('resgates_status', 'dashboard')
         
         return jsonify(resgate.to_dict()), 201
         
@@ -149,6 +179,7 @@ def entregar_brinde(resgate_id):
         resgate.data_entrega = datetime.utcnow()
         
         db.session.commit()
+        invalidar('resgates_status')
         
         return jsonify(resgate.to_dict())
         
@@ -165,15 +196,30 @@ def cancelar_resgate(resgate_id):
         if resgate.status == StatusResgateEnum.ENTREGUE:
             return jsonify({'error': 'Não é possível cancelar resgate já entregue'}), 400
         
-        # Devolver quantidade ao brinde
-        if resgate.status == StatusResgateEnum.PENDENTE:
-            brinde = Brinde.query.get(resgate.brinde_id)
-            brinde.quantidade_disponivel += 1
+        # PENDENTE -> CANCELADO num UPDATE condicional: só quem fez a transição devolve o estoque
+        cancelado = Resgate.query.filter(
+            Resgate.id == resgate_id,
+            Resgate.status == StatusResgateEnum.PENDENTE
+        ).update(
+            {Resgate.status: StatusResgateEnum.CANCELADO},
+            synchronize_session=False
+        )
         
-        resgate.status = StatusResgateEnum.CANCELADO
+        # Devolver quantidade ao brinde
+        if cancelado:
+            Brinde.query.filter_by(id=resgate.brinde_id).update(
+                {Brinde.quantidade_disponivel: Brinde.quantidade_disponivel + 1},
+                synchronize_session=False
+            )
         
         db.session.commit()
         
+        # Entregue por outra requisição entre a leitura e o UPDATE
+        if resgate.status == StatusResgateEnum.ENTREGUE:
+            return jsonify({'error': 'Não é possível cancelar resgate já entregue'}), 400
+        
+        invalidar('resgates_status')
+        
         return jsonify(resgate.to_dict())
         
     except Exception as e:
@@ -188,7 +234,7 @@ def listar_resgates_cliente(cliente_id):
         per_page = request.args.get('per_page', 10, type=int)
         status_filter = request.args.get('status')
         
-        query = Resgate.query.filter_by(cliente_id=cliente_id)
+        query = Resgate.query.options(*CARGA_RESGATE).filter_by(cliente_id=cliente_id)
         
         if status_filter:
             try:
@@ -220,7 +266,7 @@ def listar_resgates():
         data_inicio = request.args.get('data_inicio')
         data_fim = request.args.get('data_fim')
         
-        query = Resgate.query
+        query = Resgate.query.options(*CARGA_RESGATE)
         
         if status_filter:
             try:
@@ -229,13 +275,7 @@ def listar_resgates():
             except ValueError:
                 return jsonify({'error': 'Status inválido'}), 400
         
-        if data_inicio:
-            data_inicio = datetime.fromisoformat(data_inicio)
-            query = query.filter(Resgate.data_resgate >= data_inicio)
-        
-        if data_fim:
-            data_fim = datetime.fromisoformat(data_fim)
-            query = query.filter(Resgate.data_resgate <= data_fim)
+        query = query.filter(*intervalo_datas(Resgate.data_resgate, data_inicio, data_fim))
         
         resgates = query.order_by(Resgate.data_resgate.desc())\
                        .paginate(page=page, per_page=per_page, error_out=False)
@@ -254,7 +294,7 @@ def listar_resgates():
 def buscar_por_voucher(voucher_codigo):
     """Busca resgate por código do voucher"""
     try:
-        resgate = Resgate.query.filter_by(voucher_codigo=voucher_codigo).first()
+        resgate = Resgate.query.options(*CARGA_RESGATE).filter_by(voucher_codigo=voucher_codigo).first()
         
         if not resgate:
             return jsonify({'error': 'Voucher não encontrado'}), 404
@@ -272,21 +312,27 @@ def listar_brindes_disponiveis(cliente_id):
         if not cliente:
             return jsonify({'error': 'Cliente não encontrado'}), 404
         
-        # Buscar campanhas ativas
+        # Dados do cliente carregados uma única vez para todos os brindes
         agora = datetime.utcnow()
-        campanhas_ativas = db.session.query(Brinde)\
-                                   .join(Brinde.campanha)\
-                                   .filter(
-                                       Brinde.quantidade_disponivel > 0,
-                                       Brinde.campanha.has(ativa=True),
-                                       Brinde.campanha.has(data_inicio <= agora),
-                                       Brinde.campanha.has(data_fim >= agora)
-                                   ).all()
+        nivel_cliente = db.session.query(Ponto.nivel_atual).filter_by(cliente_id=cliente_id).limit(1).scalar()
+        
+        # Brindes de campanhas ativas, com campanha e produto na mesma query
+        brindes = Brinde.query.join(Brinde.campanha)\
+                              .options(contains_eager(Brinde.campanha), joinedload(Brinde.produto))\
+                              .filter(
+                                  Brinde.quantidade_disponivel > 0,
+                                  Campanha.ativa == True,
+                                  Campanha.data_inicio <= agora,
+                                  Campanha.data_fim >= agora
+                              ).all()
         
         brindes_disponiveis = []
         
-        for brinde in campanhas_ativas:
-            elegivel, mensagem = verificar_elegibilidade_cliente(cliente_id, brinde.id)
+        for brinde in brindes:
+            elegivel, mensagem = checar_elegibilidade(
+                brinde.campanha, brinde.quantidade_disponivel, brinde.nivel, nivel_cliente,
+                cliente.total_visitas, agora
+            )
             
             brinde_dict = brinde.to_dict()
             brinde_dict['elegivel'] = elegivel
@@ -1,120 +1,231 @@
-from flask import Blueprint, request, jsonify
-from src.models.user import db, Cliente, Visita, Ponto, NivelEnum, LojaEnum, Campanha
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from src.models.user import db, dialect_insert, Cliente, Visita, Ponto, NivelEnum, LojaEnum, Campanha
+from src.models.schemas import VisitaCreate, VisitaLote, VisitaUpdate, mensagem_erro
+from src.cache import em_cache, invalidar
+from src.routes.datas import intervalo_datas
+from src.serializacao import json_default
+from collections import defaultdict
 from datetime import datetime
-import re
+from decimal import Decimal, ROUND_DOWN
+from pydantic import ValidationError
+from sqlalchemy import bindparam, case, exists, func, insert, or_, select
+from sqlalchemy.exc import IntegrityError
+import orjson
 
 visita_bp = Blueprint('visita', __name__)
 
+# Pontuação mínima de cada nível acima de Bronze, do maior para o menor
+_LIMIARES_NIVEL = ((1000, NivelEnum.OURO), (500, NivelEnum.PRATA))
+
+# Lookup direto valor -> LojaEnum, sem exceção como controle de fluxo
+_LOJA_POR_VALOR = {loja.value: loja for loja in LojaEnum}
+
 def calcular_nivel_por_pontos(pontos):
     """Calcula o nível baseado na pontuação"""
-    if pontos >= 1000:
-        return NivelEnum.OURO
-    elif pontos >= 500:
-        return NivelEnum.PRATA
-    else:
-        return NivelEnum.BRONZE
+    return next((nivel for minimo, nivel in _LIMIARES_NIVEL if pontos >= minimo), NivelEnum.BRONZE)
 
-def atualizar_pontos_cliente(cliente_id, valor_compra, loja=None):
-    """Atualiza os pontos do cliente baseado na compra"""
-    try:
-        # Buscar campanha ativa para a loja ou global
-        campanha = None
-        if loja:
-            campanha = Campanha.query.filter(
-                Campanha.loja == loja,
-                Campanha.ativa == True,
-                Campanha.data_inicio <= datetime.utcnow(),
-                Campanha.data_fim >= datetime.utcnow()
-            ).first()
-        
-        if not campanha:
-            # Buscar campanha global
-            campanha = Campanha.query.filter(
-                Campanha.loja.is_(None),
-                Campanha.ativa == True,
-                Campanha.data_inicio <= datetime.utcnow(),
-                Campanha.data_fim >= datetime.utcnow()
-            ).first()
-        
-        # Usar fator padrão se não houver campanha
-        fator_pontuacao = campanha.fator_pontuacao if campanha else 1.0
-        
-        # Calcular pontos da compra
-        pontos_compra = int(valor_compra * fator_pontuacao)
-        
-        # Buscar ou criar registro de pontos do cliente
-        ponto = Ponto.query.filter_by(cliente_id=cliente_id).first()
-        if not ponto:
-            ponto = Ponto(
-                cliente_id=cliente_id,
-                pontos_acumulados=0,
-                nivel_atual=NivelEnum.BRONZE
-            )
-            db.session.add(ponto)
-        
-        # Atualizar pontos
-        ponto.pontos_acumulados += pontos_compra
-        ponto.nivel_atual = calcular_nivel_por_pontos(ponto.pontos_acumulados)
-        ponto.data_atualizacao = datetime.utcnow()
-        
-        return pontos_compra
-    except Exception as e:
-        raise e
+def nivel_por_pontos_sql(pontos):
+    """Mesma regra de calcular_nivel_por_pontos como expressão SQL (grava o nome do enum)"""
+    return case(
+        *((pontos >= minimo, nivel.name) for minimo, nivel in _LIMIARES_NIVEL),
+        else_=NivelEnum.BRONZE.name
+    )
+
+# Statements montados uma única vez; a cada chamada só mudam os parâmetros.
+# A escrita de pontos não lê o registro antes: é um único upsert (atualizar_pontos_cliente)
+_PONTO_POR_CLIENTE = select(Ponto).where(Ponto.cliente_id == bindparam('cliente_id')).limit(1)
+
+# loja = NULL nunca casa, então sem loja só a campanha global é considerada;
+# com loja, a campanha da loja vem antes da global
+_FATOR_CAMPANHA = select(Campanha.fator_pontuacao).where(
+    or_(Campanha.loja == bindparam('loja'), Campanha.loja.is_(None)),
+    Campanha.ativa == True,
+    Campanha.data_inicio <= bindparam('agora'),
+    Campanha.data_fim >= bindparam('agora')
+).order_by(case((Campanha.loja.is_(None), 1), else_=0)).limit(1)
+
+def buscar_ponto(cliente_id):
+    """Registro de pontos do cliente (ou None)"""
+    return db.session.scalars(_PONTO_POR_CLIENTE, {'cliente_id': cliente_id}).first()
+
+def buscar_fator_pontuacao(loja=None):
+    """Fator da campanha ativa para a loja (ou global); 1.0 se não houver campanha"""
+    fator = db.session.scalar(_FATOR_CAMPANHA, {'loja': loja, 'agora': datetime.utcnow()})
+    
+    # Usar fator padrão se não houver campanha
+    return fator if fator is not None else 1.0
+
+def fator_pontuacao_vigente(loja=None):
+    """Fator da campanha em cache por 30s; CRUD de campanhas invalida o namespace"""
+    return em_cache(
+        'campanhas',
+        f"fator:{loja.value if loja else 'global'}",
+        lambda: buscar_fator_pontuacao(loja),
+        timeout=30
+    )
+
+def somar_pontos(pontos_por_cliente):
+    """Soma {cliente_id: pontos} aos registros de pontos num único INSERT ... ON CONFLICT.
+
+    Clientes sem registro ganham um; o nível é calculado pelo banco sobre o novo
+    total. Retorna os Ponto atualizados, lidos do RETURNING.
+    """
+    agora = datetime.utcnow()
+    upsert = dialect_insert(Ponto)
+    novo_total = Ponto.pontos_acumulados + upsert.excluded.pontos_acumulados
+    upsert = upsert.on_conflict_do_update(
+        index_elements=['cliente_id'],
+        set_={
+            'pontos_acumulados': novo_total,
+            'nivel_atual': nivel_por_pontos_sql(novo_total),
+            'data_atualizacao': upsert.excluded.data_atualizacao
+        }
+    ).returning(Ponto)
+    
+    registros = [
+        {
+            'cliente_id': cliente_id,
+            'pontos_acumulados': pontos,
+            'nivel_atual': calcular_nivel_por_pontos(pontos),
+            'data_atualizacao': agora
+        }
+        for cliente_id, pontos in pontos_por_cliente.items()
+    ]
+    return db.session.scalars(upsert, registros, execution_options={'populate_existing': True}).all()
+
+def calcular_pontos_compra(valor_compra, loja=None):
+    """Pontos de uma compra pelo fator da campanha vigente (aritmética decimal, parte inteira)"""
+    fator = Decimal(str(fator_pontuacao_vigente(loja)))
+    return int((Decimal(valor_compra) * fator).to_integral_value(rounding=ROUND_DOWN))
+
+def atualizar_pontos_cliente(cliente_id, pontos):
+    """Soma os pontos (negativos para estorno) ao cliente; retorna o Ponto atualizado"""
+    ponto, = somar_pontos({cliente_id: pontos})
+    return ponto
+
+def pontos_da_visita(visita):
+    """Pontos gerados pela visita; visitas anteriores à coluna são estimadas pelo fator vigente"""
+    if visita.pontos_gerados is not None:
+        return visita.pontos_gerados
+    return calcular_pontos_compra(visita.valor_compra, visita.loja)
 
 @visita_bp.route('/visitas', methods=['POST'])
 def registrar_visita():
     """Registra uma nova visita e atualiza pontos"""
     try:
-        data = request.get_json()
-        
-        # Validações
-        if not data.get('cliente_id') or not data.get('valor_compra'):
-            return jsonify({'error': 'cliente_id e valor_compra são obrigatórios'}), 400
-        
-        cliente_id = data['cliente_id']
-        valor_compra = float(data['valor_compra'])
-        
-        if valor_compra <= 0:
-            return jsonify({'error': 'Valor da compra deve ser maior que zero'}), 400
-        
-        # Verificar se cliente existe
-        cliente = Cliente.query.get(cliente_id)
-        if not cliente:
+        # Validação antes de qualquer acesso ao banco
+        try:
+            payload = VisitaCreate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
+        
+        cliente_id = payload.cliente_id
+        valor_compra = payload.valor_compra
+        loja = payload.loja
+        
+        # Verificar se cliente existe (EXISTS, sem carregar a linha); o SQLite não aplica
+        # a FK por padrão, então a checagem fica mesmo com a FK tratada abaixo
+        if not db.session.query(exists().where(Cliente.id == cliente_id)).scalar():
             return jsonify({'error': 'Cliente não encontrado'}), 404
         
-        # Processar loja se fornecida
-        loja = None
-        if data.get('loja'):
-            try:
-                loja = LojaEnum(data['loja'])
-            except ValueError:
-                return jsonify({'error': 'Loja inválida'}), 400
-        
-        # Criar visita
+        # Criar visita guardando os pontos gerados, para estorno exato
+        pontos_ganhos = calcular_pontos_compra(valor_compra, loja)
         visita = Visita(
             cliente_id=cliente_id,
             valor_compra=valor_compra,
             loja=loja,
-            data_visita=datetime.utcnow()
+            data_visita=datetime.utcnow(),
+            pontos_gerados=pontos_ganhos
         )
         
         db.session.add(visita)
-        db.session.flush()
+        
+        # Cliente excluído entre a checagem e o INSERT é barrado pela FK (PostgreSQL)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({'error': 'Cliente não encontrado'}), 404
         
         # Atualizar pontos
-        pontos_ganhos = atualizar_pontos_cliente(cliente_id, valor_compra, loja)
+        ponto = atualizar_pontos_cliente(cliente_id, pontos_ganhos)
+        
+        # Montar a resposta antes do commit, que expira os objetos da sessão
+        resposta = {
+            'visita': visita.to_dict(),
+            'pontos_ganhos': pontos_ganhos,
+            'pontos_totais': ponto.pontos_acumulados,
+            'nivel_atual': ponto.nivel_atual
+        }
         
         db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard', 'visitas')
         
-        # Retornar informações da visita e pontos atualizados
-        ponto = Ponto.query.filter_by(cliente_id=cliente_id).first()
+        return jsonify(resposta), 201
         
-        return jsonify({
-            'visita': visita.to_dict(),
-            'pontos_ganhos': pontos_ganhos,
-            'pontos_totais': ponto.pontos_acumulados if ponto else 0,
-            'nivel_atual': ponto.nivel_atual.value if ponto else 'Bronze'
-        }), 201
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@visita_bp.route('/visitas/batch', methods=['POST'])
+def registrar_visitas_lote():
+    """Registra várias visitas numa única transação (sincronização do PDV)"""
+    try:
+        try:
+            itens = VisitaLote.model_validate_json(request.get_data()).root
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
+        
+        # Lote atômico: qualquer cliente inexistente rejeita tudo
+        ids = {item.cliente_id for item in itens}
+        existentes = set(db.session.scalars(select(Cliente.id).where(Cliente.id.in_(ids))))
+        if ids - existentes:
+            return jsonify({
+                'error': 'Cliente não encontrado',
+                'cliente_ids': sorted(ids - existentes)
+            }), 404
+        
+        # Pontos de cada visita e soma por cliente
+        pontos_por_visita = [calcular_pontos_compra(item.valor_compra, item.loja) for item in itens]
+        pontos_por_cliente = defaultdict(int)
+        for item, pontos in zip(itens, pontos_por_visita):
+            pontos_por_cliente[item.cliente_id] += pontos
+        
+        # Um INSERT multi-linha para as visitas (RETURNING na ordem do lote) e um upsert
+        # para os pontos de todos os clientes
+        agora = datetime.utcnow()
+        visitas = db.session.scalars(
+            insert(Visita).returning(Visita, sort_by_parameter_order=True),
+            [
+                {
+                    'cliente_id': item.cliente_id,
+                    'valor_compra': item.valor_compra,
+                    'loja': item.loja,
+                    'data_visita': agora,
+                    'pontos_gerados': pontos
+                }
+                for item, pontos in zip(itens, pontos_por_visita)
+            ],
+            # NULL explícito: loja ausente não divide o lote em vários INSERTs
+            execution_options={'render_nulls': True}
+        ).all()
+        pontos = {ponto.cliente_id: ponto for ponto in somar_pontos(pontos_por_cliente)}
+        
+        # Resultado na ordem do lote, com o saldo final de cada cliente
+        resultado = [
+            {
+                'visita': visita.to_dict(),
+                'pontos_ganhos': pontos_ganhos,
+                'pontos_totais': pontos[visita.cliente_id].pontos_acumulados,
+                'nivel_atual': pontos[visita.cliente_id].nivel_atual
+            }
+            for visita, pontos_ganhos in zip(visitas, pontos_por_visita)
+        ]
+        
+        db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard', 'visitas')
+        
+        return jsonify({'visitas': resultado, 'total': len(resultado)}), 201
         
     except Exception as e:
         db.session.rollback()
@@ -124,22 +235,32 @@ def registrar_visita():
 def listar_visitas_cliente(cliente_id):
     """Lista todas as visitas de um cliente"""
     try:
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 10, type=int)
-        
-        # Verificar se cliente existe
-        cliente = Cliente.query.get(cliente_id)
-        if not cliente:
-            return jsonify({'error': 'Cliente não encontrado'}), 404
-        
-        visitas = Visita.query.filter_by(cliente_id=cliente_id)\
-                             .order_by(Visita.data_visita.desc())\
-                             .paginate(page=page, per_page=per_page, error_out=False)
+        page = max(request.args.get('page', 1, type=int), 1)
+        per_page = max(request.args.get('per_page', 10, type=int), 1)
+        
+        # Página, total (COUNT(*) OVER, calculado antes do LIMIT) e cliente numa só consulta
+        linhas = db.session.execute(
+            select(Visita, Cliente, func.count().over().label('total'))
+            .join(Cliente, Cliente.id == Visita.cliente_id)
+            .where(Visita.cliente_id == cliente_id)
+            .order_by(Visita.data_visita.desc())
+            .limit(per_page)
+            .offset((page - 1) * per_page)
+        ).all()
+        
+        if linhas:
+            cliente, total = linhas[0].Cliente, linhas[0].total
+        else:
+            # Página vazia: verificar se cliente existe e contar fora da janela
+            cliente = db.session.get(Cliente, cliente_id)
+            if not cliente:
+                return jsonify({'error': 'Cliente não encontrado'}), 404
+            total = Visita.query.filter_by(cliente_id=cliente_id).count() if page > 1 else 0
         
         return jsonify({
-            'visitas': [visita.to_dict() for visita in visitas.items],
-            'total': visitas.total,
-            'pages': visitas.pages,
+            'visitas': [linha.Visita.to_dict() for linha in linhas],
+            'total': total,
+            'pages': -(-total // per_page),
             'current_page': page,
             'cliente': cliente.to_dict()
         })
@@ -160,30 +281,30 @@ def obter_visita(visita_id):
 def atualizar_visita(visita_id):
     """Atualiza uma visita existente"""
     try:
+        try:
+            payload = VisitaUpdate.model_validate_json(request.get_data())
+        except ValidationError as e:
+            return jsonify({'error': mensagem_erro(e)}), 400
+        
         visita = Visita.query.get_or_404(visita_id)
-        data = request.get_json()
         
         valor_antigo = visita.valor_compra
+        pontos_antigos = pontos_da_visita(visita)
         
-        if 'valor_compra' in data:
-            novo_valor = float(data['valor_compra'])
-            if novo_valor <= 0:
-                return jsonify({'error': 'Valor da compra deve ser maior que zero'}), 400
-            visita.valor_compra = novo_valor
+        if payload.valor_compra is not None:
+            visita.valor_compra = payload.valor_compra
         
-        if 'loja' in data and data['loja']:
-            try:
-                visita.loja = LojaEnum(data['loja'])
-            except ValueError:
-                return jsonify({'error': 'Loja inválida'}), 400
+        if payload.loja:
+            visita.loja = payload.loja
         
         # Se o valor mudou, recalcular pontos
-        if 'valor_compra' in data and valor_antigo != visita.valor_compra:
-            # Remover pontos antigos e adicionar novos
-            diferenca = visita.valor_compra - valor_antigo
-            atualizar_pontos_cliente(visita.cliente_id, diferenca, visita.loja)
+        if valor_antigo != visita.valor_compra:
+            # Estornar exatamente os pontos gerados e pontuar o novo valor
+            visita.pontos_gerados = calcular_pontos_compra(visita.valor_compra, visita.loja)
+            atualizar_pontos_cliente(visita.cliente_id, visita.pontos_gerados - pontos_antigos)
         
         db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard', 'visitas')
         return jsonify(visita.to_dict())
         
     except Exception as e:
@@ -196,11 +317,12 @@ def excluir_visita(visita_id):
     try:
         visita = Visita.query.get_or_404(visita_id)
         
-        # Remover pontos correspondentes
-        atualizar_pontos_cliente(visita.cliente_id, -visita.valor_compra, visita.loja)
+        # Estornar os pontos gerados pela visita, sem consultar campanhas
+        atualizar_pontos_cliente(visita.cliente_id, -pontos_da_visita(visita))
         
         db.session.delete(visita)
         db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard', 'visitas')
         
         return jsonify({'message': 'Visita excluída com sucesso'})
         
@@ -216,7 +338,7 @@ def obter_pontos_cliente(cliente_id):
         if not cliente:
             return jsonify({'error': 'Cliente não encontrado'}), 404
         
-        ponto = Ponto.query.filter_by(cliente_id=cliente_id).first()
+        ponto = buscar_ponto(cliente_id)
         if not ponto:
             # Criar registro de pontos se não existir
             ponto = Ponto(
@@ -226,15 +348,13 @@ def obter_pontos_cliente(cliente_id):
             )
             db.session.add(ponto)
             db.session.commit()
-        
-        # Calcular estatísticas
-        total_visitas = len(cliente.visitas)
-        valor_total_compras = sum([v.valor_compra for v in cliente.visitas])
+            invalidar('distribuicao_niveis', 'dashboard')
         
         return jsonify({
             'pontos': ponto.to_dict(),
-            'total_visitas': total_visitas,
-            'valor_total_compras': valor_total_compras,
+            # Contadores mantidos por triggers em visitas
+            'total_visitas': cliente.total_visitas,
+            'valor_total_compras': cliente.total_gasto,
             'cliente': cliente.to_dict()
         })
         
@@ -250,39 +370,49 @@ def relatorio_visitas():
         data_fim = request.args.get('data_fim')
         loja = request.args.get('loja')
         
-        query = Visita.query
-        
-        if data_inicio:
-            data_inicio = datetime.fromisoformat(data_inicio)
-            query = query.filter(Visita.data_visita >= data_inicio)
-        
-        if data_fim:
-            data_fim = datetime.fromisoformat(data_fim)
-            query = query.filter(Visita.data_visita <= data_fim)
+        filtros = list(intervalo_datas(Visita.data_visita, data_inicio, data_fim))
         
         if loja:
-            try:
-                loja_enum = LojaEnum(loja)
-                query = query.filter(Visita.loja == loja_enum)
-            except ValueError:
+            loja_enum = _LOJA_POR_VALOR.get(loja)
+            if loja_enum is None:
                 return jsonify({'error': 'Loja inválida'}), 400
-        
-        visitas = query.order_by(Visita.data_visita.desc()).all()
-        
-        # Estatísticas
-        total_visitas = len(visitas)
-        valor_total = sum([v.valor_compra for v in visitas])
-        valor_medio = valor_total / total_visitas if total_visitas > 0 else 0
-        
-        return jsonify({
-            'visitas': [visita.to_dict() for visita in visitas],
-            'estatisticas': {
-                'total_visitas': total_visitas,
-                'valor_total': valor_total,
-                'valor_medio': valor_medio
-            }
-        })
+            filtros.append(Visita.loja == loja_enum)
+        
+        def calcular_estatisticas():
+            # Estatísticas agregadas no banco, já serializadas
+            total_visitas, valor_total, valor_medio = db.session.execute(
+                select(
+                    func.count(),
+                    func.coalesce(func.sum(Visita.valor_compra), 0),
+                    func.coalesce(func.avg(Visita.valor_compra), 0)
+                ).select_from(Visita).where(*filtros)
+            ).one()
+            return orjson.dumps({
+                'estatisticas': {
+                    'total_visitas': total_visitas,
+                    'valor_total': valor_total,
+                    'valor_medio': valor_medio
+                }
+            }, default=json_default)
+        
+        # Só o agregado vai para o cache (tamanho fixo); as linhas são sempre transmitidas
+        # do banco. Escritas de visitas invalidam o namespace
+        estatisticas = em_cache('visitas', f'estatisticas:{data_inicio}|{data_fim}|{loja}', calcular_estatisticas)
+        
+        visitas = select(Visita).where(*filtros)\
+                                .order_by(Visita.data_visita.desc())\
+                                .execution_options(yield_per=1000)
+        
+        def gerar():
+            # Visitas lidas em lotes e serializadas uma a uma: memória constante
+            yield b'{"visitas":['
+            separador = b''
+            for visita in db.session.scalars(visitas):
+                yield separador + orjson.dumps(visita.to_dict(), default=json_default)
+                separador = b','
+            yield b'],' + estatisticas[1:]
+        
+        return Response(stream_with_context(gerar()), mimetype='application/json')
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
-
@@ -0,0 +1,9 @@
+"""Serialização JSON compartilhada pelo JSONProvider e pelas respostas em streaming."""
+from decimal import Decimal
+
+def json_default(obj):
+    """Tipos que o orjson não serializa nativamente"""
+    # Valores monetários (NUMERIC) saem como número, não como string
+    if isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f'Object of type {type(obj).__name__} is not JSON serializable')
@@ -0,0 +1,29 @@
+"""Tarefas executadas fora do ciclo da requisição.
+
+Com REDIS_URL definido as tarefas vão para uma fila RQ, processada por
+`rq worker --url $REDIS_URL` (executado na raiz do projeto); sem Redis, `fila` é None
+e as rotas fazem o trabalho na própria transação.
+"""
+import os
+from src.models.user import db, Ponto, NivelEnum
+from src.cache import invalidar
+
+fila = None
+if os.getenv('REDIS_URL'):
+    from redis import Redis
+    from rq import Queue
+    fila = Queue(connection=Redis.from_url(os.environ['REDIS_URL']))
+
+def criar_ponto_inicial(cliente_id):
+    """Cria o registro de pontos inicial do cliente (idempotente)"""
+    from src.main import app
+    with app.app_context():
+        if Ponto.query.filter_by(cliente_id=cliente_id).first():
+            return
+        db.session.add(Ponto(
+            cliente_id=cliente_id,
+            pontos_acumulados=0,
+            nivel_atual=NivelEnum.BRONZE
+        ))
+        db.session.commit()
+        invalidar('distribuicao_niveis', 'dashboard')
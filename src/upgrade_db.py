@@ -0,0 +1,191 @@
+"""Atualiza um banco já existente para o schema atual.
+
+create_all só cria tabelas que ainda não existem: colunas novas, índices novos,
+mudanças de tipo e triggers em tabelas existentes ficam para este script.
+Idempotente, roda numa única transação; bancos novos usam apenas src.init_db.
+
+Uso: python -m src.upgrade_db
+"""
+from sqlalchemy import DDL, Date, cast, delete, func, inspect, literal_column, select, update
+from sqlalchemy.schema import CreateColumn
+from src.main import app
+from src.models.user import (
+    db, Cliente, Visita, Ponto, Campanha, Brinde, Resgate, DashboardSummary, VisitasDaily,
+    StatusResgateEnum, RESUMO_DELTAS, TRIGGERS_SQLITE, TRIGGERS_POSTGRESQL
+)
+
+# Colunas cujo tipo mudou depois da criação das tabelas (valores monetários e enums nativos)
+COLUNAS_NUMERICAS = tuple(
+    modelo.__table__.c[coluna] for modelo, coluna in (
+        (Visita, 'valor_compra'), (Cliente, 'total_gasto'),
+        (DashboardSummary, 'valor_total'), (VisitasDaily, 'valor_total')
+    )
+)
+COLUNAS_ENUM = tuple(
+    modelo.__table__.c[coluna] for modelo, coluna in (
+        (Visita, 'loja'), (Campanha, 'loja'), (Ponto, 'nivel_atual'), (Brinde, 'nivel'), (Resgate, 'status')
+    )
+)
+
+def remover_triggers(conn, dialeto, triggers):
+    """Remove os triggers conhecidos para recriá-los com a definição atual"""
+    for tabela, comandos in triggers.items():
+        for comando in comandos:
+            if not comando.startswith('CREATE TRIGGER'):
+                continue
+            nome = comando.split()[2]
+            if dialeto == 'postgresql':
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {nome} ON {tabela}')
+            else:
+                conn.exec_driver_sql(f'DROP TRIGGER IF EXISTS {nome}')
+
+def adicionar_colunas(conn):
+    """ALTER TABLE ... ADD COLUMN para as colunas do modelo ausentes no banco"""
+    inspetor = inspect(conn)
+    for tabela in db.metadata.sorted_tables:
+        existentes = {coluna['name'] for coluna in inspetor.get_columns(tabela.name)}
+        for coluna in tabela.columns:
+            if coluna.name not in existentes:
+                definicao = CreateColumn(coluna).compile(dialect=conn.dialect)
+                conn.exec_driver_sql(f'ALTER TABLE {tabela.name} ADD COLUMN {definicao}')
+
+def atualizar_tipos(conn, dialeto):
+    """Converte valores monetários para NUMERIC e enums nativos para VARCHAR (só PostgreSQL).
+
+    O SQLite não impõe o tipo declarado: lá basta arredondar os valores aos centavos.
+    """
+    if dialeto != 'postgresql':
+        for coluna in COLUNAS_NUMERICAS:
+            conn.execute(
+                update(coluna.table).values({coluna: func.round(coluna, 2)})
+                .where(coluna != func.round(coluna, 2))
+            )
+        return
+
+    inspetor = inspect(conn)
+    for colunas, conversao in ((COLUNAS_NUMERICAS, 'ROUND({}::numeric, 2)'), (COLUNAS_ENUM, '{}::text')):
+        for coluna in colunas:
+            atual = next(c['type'] for c in inspetor.get_columns(coluna.table.name) if c['name'] == coluna.name)
+            tipo = coluna.type.compile(dialect=conn.dialect)
+            if atual.compile(dialect=conn.dialect) == tipo:
+                continue
+            conn.exec_driver_sql(
+                f'ALTER TABLE {coluna.table.name} ALTER COLUMN {coluna.name} '
+                f'TYPE {tipo} USING {conversao.format(coluna.name)}'
+            )
+
+def remover_pontos_duplicados(conn):
+    """Mantém só o primeiro registro de pontos de cada cliente (o que a aplicação lia)"""
+    pontos = Ponto.__table__
+    primeiros = select(func.min(pontos.c.id)).group_by(pontos.c.cliente_id)
+    conn.execute(delete(pontos).where(pontos.c.id.not_in(primeiros)))
+
+def cancelar_resgates_duplicados(conn):
+    """Cancela resgates pendentes repetidos (mesmo cliente e brinde), devolvendo o estoque reservado"""
+    resgates, brindes = Resgate.__table__, Brinde.__table__
+    pendente = resgates.c.status == StatusResgateEnum.PENDENTE.name
+    primeiros = select(func.min(resgates.c.id)).where(pendente).group_by(resgates.c.cliente_id, resgates.c.brinde_id)
+    duplicados = select(resgates.c.id).where(pendente, resgates.c.id.not_in(primeiros))
+    conn.execute(update(brindes).values(
+        quantidade_disponivel=brindes.c.quantidade_disponivel + select(func.count())
+            .where(resgates.c.brinde_id == brindes.c.id, resgates.c.id.in_(duplicados)).scalar_subquery()
+    ).where(brindes.c.id.in_(select(resgates.c.brinde_id).where(resgates.c.id.in_(duplicados)))))
+    conn.execute(
+        update(resgates).values(status=StatusResgateEnum.CANCELADO.name).where(resgates.c.id.in_(duplicados))
+    )
+
+def criar_indices(conn):
+    """Cria os índices do modelo ausentes; índice existente sem a unicidade do modelo é recriado"""
+    inspetor = inspect(conn)
+    for tabela in db.metadata.sorted_tables:
+        existentes = {indice['name']: indice for indice in inspetor.get_indexes(tabela.name)}
+        for indice in tabela.indexes:
+            atual = existentes.get(indice.name)
+            if atual is not None and bool(atual['unique']) != indice.unique:
+                indice.drop(conn)
+            indice.create(conn, checkfirst=True)
+
+def mes(coluna, dialeto):
+    """Chave 'YYYY-MM' do registro, como nos triggers do dashboard_summary"""
+    data = func.coalesce(coluna, func.current_timestamp())
+    if dialeto == 'postgresql':
+        return func.to_char(data, 'YYYY-MM')
+    return func.strftime('%Y-%m', data)
+
+def recalcular_contadores(conn, dialeto):
+    """Recalcula clientes.total_*, dashboard_summary e visitas_daily a partir das tabelas de origem"""
+    clientes, visitas, pontos = Cliente.__table__, Visita.__table__, Ponto.__table__
+    conn.execute(update(clientes).values(
+        total_visitas=select(func.count()).where(visitas.c.cliente_id == clientes.c.id).scalar_subquery(),
+        total_gasto=select(func.coalesce(func.round(func.sum(visitas.c.valor_compra), 2), 0))
+            .where(visitas.c.cliente_id == clientes.c.id).scalar_subquery(),
+        pontos_totais=select(func.coalesce(func.sum(pontos.c.pontos_acumulados), 0))
+            .where(pontos.c.cliente_id == clientes.c.id).scalar_subquery()
+    ))
+
+    # Mesmos deltas dos triggers, somados sobre todas as linhas: 'GLOBAL' e um período por mês
+    resumo = {}
+    for tabela, (coluna_data, _, deltas) in RESUMO_DELTAS.items():
+        somas = [
+            func.coalesce(
+                func.round(func.sum(literal_column(expressao.format(r=tabela))), 2)
+                if coluna == 'valor_total' else func.sum(literal_column(expressao.format(r=tabela))),
+                0
+            ).label(coluna)
+            for coluna, expressao in deltas.items()
+        ]
+        origem = db.metadata.tables[tabela]
+        consultas = [select(literal_column("'GLOBAL'").label('periodo'), *somas).select_from(origem)]
+        if coluna_data:
+            consultas.append(
+                select(mes(origem.c[coluna_data], dialeto).label('periodo'), *somas)
+                .select_from(origem).group_by('periodo')
+            )
+        for consulta in consultas:
+            for linha in conn.execute(consulta).mappings():
+                periodo = resumo.setdefault(linha['periodo'], {})
+                periodo.update((coluna, linha[coluna]) for coluna in deltas)
+
+    resumo_tabela = DashboardSummary.__table__
+    colunas = [c.name for c in resumo_tabela.columns if c.name != 'period_key']
+    conn.execute(delete(resumo_tabela))
+    conn.execute(resumo_tabela.insert(), [
+        {'period_key': periodo, **{c: valores.get(c, 0) for c in colunas}}
+        for periodo, valores in resumo.items()
+    ])
+
+    daily = VisitasDaily.__table__
+    data = func.coalesce(visitas.c.data_visita, func.current_timestamp())
+    dia = cast(data, Date) if dialeto == 'postgresql' else func.date(data)
+    conn.execute(delete(daily))
+    conn.execute(daily.insert().from_select(
+        ['data', 'total_visitas', 'valor_total'],
+        select(dia.label('dia'), func.count(), func.round(func.sum(visitas.c.valor_compra), 2)).group_by('dia')
+    ))
+
+def upgrade_db():
+    with app.app_context(), db.engine.begin() as conn:
+        dialeto = conn.dialect.name
+        triggers = TRIGGERS_POSTGRESQL if dialeto == 'postgresql' else TRIGGERS_SQLITE
+
+        # Tabelas novas (dashboard_summary, visitas_daily) e a extensão pg_trgm
+        db.metadata.create_all(conn)
+
+        # Sem triggers durante a migração: os contadores são recalculados no final
+        remover_triggers(conn, dialeto, triggers)
+        adicionar_colunas(conn)
+        atualizar_tipos(conn, dialeto)
+
+        # Duplicatas impediriam o índice único usado pelo upsert de pontos (ON CONFLICT (cliente_id))
+        remover_pontos_duplicados(conn)
+        # Idem para o índice único parcial de resgates pendentes
+        cancelar_resgates_duplicados(conn)
+        criar_indices(conn)
+
+        for comandos in triggers.values():
+            for comando in comandos:
+                conn.execute(DDL(comando))
+        recalcular_contadores(conn, dialeto)
+
+if __name__ == '__main__':
+    upgrade_db()